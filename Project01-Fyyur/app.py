@@ -2,36 +2,108 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import csv
+import io
 import json
+import math
+import re
+import time
+from functools import lru_cache
+from datetime import datetime, timedelta
+from itertools import groupby
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
+from flask.json import JSONEncoder
+from flask.logging import default_handler
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
+import click
 import logging
-from logging import Formatter, FileHandler
+from logging import Formatter, FileHandler, StreamHandler
 from flask_wtf import Form
 from forms import *
+from cache import ResponseCache
+from compress import Compress
+from geo import CentroidGeocoder
+from recommend import Recommender
+from metrics import PoolMetrics
+from profiler import SQLProfiler
 import sys
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
+class ISOJSONEncoder(JSONEncoder):
+    """
+    Encode datetimes in ISO 8601 rather than the HTTP date format.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
 app = Flask(__name__)
+app.json_encoder = ISOJSONEncoder
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+pool_metrics = PoolMetrics()
+db = SQLAlchemy(app, engine_options={"poolclass": pool_metrics.pool_class()})
 migrate = Migrate(app, db)
+cache = ResponseCache(app)
+profiler = SQLProfiler(app)
+compress = Compress(app)
+geocoder = CentroidGeocoder(app)
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+DEFAULT_SHOW_DURATION = 120
+
+DEFAULT_IMAGE_LINK = 'https://images.unsplash.com/photo-1534294668821-28a3054f4256?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80'
+
+class SoftDelete:
+    """
+    Rows are deleted by stamping `deleted_at` and stay in the table, with
+    their shows, until `flask purge-deleted` removes them. Queries must
+    leave out rows where deleted_at is set.
+    """
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    @classmethod
+    def get_active(cls, entity_id):
+        return cls.query.filter(cls.id == entity_id,
+                                cls.deleted_at.is_(None)).first()
+
 
-class Venue(db.Model):
+class Versioned:
+    """
+    Rows carry a version bumped by every edit, see update_active().
+    """
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+
+class Venue(SoftDelete, Versioned, db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venue_city_trgm', 'city', postgresql_using='gin',
+                 postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_venue_state_city', 'state', 'city'),
+        db.Index('ix_venue_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -41,16 +113,41 @@ class Venue(db.Model):
     phone = db.Column(db.String(120), nullable=False)
     genres = db.Column(db.ARRAY(db.String), nullable=False)
     image_link = db.Column(db.String(500), nullable=False,
-                           default='https://images.unsplash.com/photo-1534294668821-28a3054f4256?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80')
+                           default=DEFAULT_IMAGE_LINK)
     website = db.Column(db.String(120), nullable=True)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500), nullable=True)
     facebook_link = db.Column(db.String(120), nullable=False)
-    show = db.relationship("Shows", backref="venue", lazy=False)
+    # Maintained by triggers on Shows, see ShowCounterSweep.
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0,
+                                     server_default='0')
+    # Centroid of the city, set by geocode() or `flask geocode-venues`.
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    show = db.relationship("Shows", backref="venue", lazy=True)
+
+    def geocode(self):
+        self.latitude, self.longitude = \
+            geocoder.locate(self.city, self.state) or (None, None)
 
 
-class Artist(db.Model):
+db.Index('ix_venue_location',
+         db.func.ll_to_earth(Venue.latitude, Venue.longitude), Venue.id,
+         postgresql_using='gist',
+         postgresql_where=db.text('deleted_at IS NULL AND latitude IS NOT NULL'))
+
+
+class Artist(SoftDelete, Versioned, db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artist_city_trgm', 'city', postgresql_using='gin',
+                 postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_artist_state_city', 'state', 'city'),
+        db.Index('ix_artist_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -59,43 +156,489 @@ class Artist(db.Model):
     phone = db.Column(db.String(120), nullable=False)
     genres = db.Column(db.ARRAY(db.String), nullable=False)
     image_link = db.Column(db.String(500), nullable=False,
-                           default='https://images.unsplash.com/photo-1534294668821-28a3054f4256?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80')
+                           default=DEFAULT_IMAGE_LINK)
     website = db.Column(db.String(120), nullable=True)
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500), nullable=True)
     facebook_link = db.Column(db.String(120), nullable=False)
+    # Maintained by triggers on Shows, see ShowCounterSweep.
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0,
+                                     server_default='0')
     show = db.relationship("Shows", backref="artist", lazy=True)
 
 
+# Time booked by a show. Shows without a duration (some shows listed
+# before durations existed) book an empty range and never conflict.
+SHOW_RANGE = ("tsrange(start_time, start_time + "
+              "coalesce(duration, 0) * interval '1 minute')")
+
+
 class Shows(db.Model):
     __tablename__ = 'Shows'
     __table_args__ = (
-        db.UniqueConstraint('artist_id', 'venue_id', 'start_time'),)
+        db.UniqueConstraint('artist_id', 'venue_id', 'start_time'),
+        db.CheckConstraint('duration > 0', name='ck_shows_duration'),
+        postgresql.ExcludeConstraint(
+            ('venue_id', '='), (db.text(SHOW_RANGE), '&&'),
+            using='gist', name='ex_shows_venue_booking'),
+        postgresql.ExcludeConstraint(
+            ('artist_id', '='), (db.text(SHOW_RANGE), '&&'),
+            using='gist', name='ex_shows_artist_booking'),
+        db.Index('ix_shows_start_time_show_id', 'start_time', 'show_id'),
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),)
 
     show_id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey(
         "Artist.id"), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey("Venue.id"), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    # Length of the booking in minutes.
+    duration = db.Column(db.Integer, nullable=True,
+                         server_default=str(DEFAULT_SHOW_DURATION))
     image_link = db.Column(db.String(500), nullable=False,
-                           default='https://images.unsplash.com/photo-1534294668821-28a3054f4256?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80')
+                           default=DEFAULT_IMAGE_LINK)
+
+
+class ShowCounterSweep(db.Model):
+    """
+    Single row holding the watermark of the upcoming show counters.
+    Venue/Artist.upcoming_shows_count count the shows starting after
+    `swept_at` whose venue and artist are both live; triggers on Shows
+    keep them current on every write, soft_delete() on every deletion, and
+    `flask sweep-counters` advances the watermark as shows go by.
+    """
+    __tablename__ = 'show_counter_sweep'
+    __table_args__ = (db.CheckConstraint('id = 1'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    swept_at = db.Column(db.DateTime, nullable=False)
 
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=None)
+def compile_datetime_format(format, locale):
+    """
+    Parse a named or literal Babel pattern and its locale once
+    per (format, locale) pair.
+    """
+    pattern = babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+    return pattern, babel.Locale.parse(locale)
+
+
+@lru_cache(maxsize=app.config["DATETIME_CACHE_SIZE"])
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+    """
+    Format a datetime, or a string holding one, with a cached pattern.
+    Results are memoized since listings repeat the same show times.
+    """
+    if not isinstance(value, datetime):
+        value = dateutil.parser.parse(value)
+    pattern, locale = compile_datetime_format(format, locale)
+    return pattern.apply(value, locale)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def encode_cursor(start_time, show_id):
+    """
+    Build an opaque keyset cursor from the (start_time, show_id)
+    of the last show on a page.
+    """
+    return "{}_{}".format(start_time.strftime('%Y%m%d%H%M%S%f'), show_id)
+
+
+def decode_cursor(cursor):
+    """
+    Split a cursor made by encode_cursor back into (start_time, show_id).
+    Returns None if the cursor is missing or malformed.
+    """
+    try:
+        start_time, show_id = cursor.split("_")
+        return datetime.strptime(start_time, '%Y%m%d%H%M%S%f'), int(show_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def show_counts(column, entity_id, other, now):
+    """
+    Count past and upcoming shows of a venue or artist in the database.
+    `column` is Shows.venue_id or Shows.artist_id; shows with a deleted
+    `other` side are left out, as partitioned_shows() leaves them out.
+    """
+    return db.session.query(
+        db.func.count(Shows.show_id).filter(
+            Shows.start_time <= now).label('past_shows_count'),
+        db.func.count(Shows.show_id).filter(
+            Shows.start_time > now).label('upcoming_shows_count')
+    ).select_from(Shows).join(other) \
+        .filter(column == entity_id, other.deleted_at.is_(None)).one()
+
+
+def partitioned_shows(column, entity_id, other, now, upcoming, limit, cursor=None):
+    """
+    Fetch one page of upcoming or past shows of a venue or artist,
+    joined with the other side of the booking (`other` is Artist or Venue).
+
+    Upcoming shows are ordered soonest first and past shows newest first,
+    both paginated with a keyset cursor on (start_time, show_id).
+    """
+    query = db.session.query(
+        Shows.show_id,
+        Shows.start_time,
+        other.id,
+        other.name,
+        other.image_link
+    ).join(other).filter(column == entity_id, other.deleted_at.is_(None))
+
+    keyset = db.tuple_(Shows.start_time, Shows.show_id)
+
+    if upcoming:
+        query = query.filter(Shows.start_time > now) \
+            .order_by(Shows.start_time, Shows.show_id)
+        if cursor:
+            query = query.filter(keyset > db.tuple_(*cursor))
+    else:
+        query = query.filter(Shows.start_time <= now) \
+            .order_by(Shows.start_time.desc(), Shows.show_id.desc())
+        if cursor:
+            query = query.filter(keyset < db.tuple_(*cursor))
+
+    return query.limit(limit).all()
+
+
+def format_shows(shows, prefix):
+    """
+    Shape rows from partitioned_shows for the templates, where `prefix`
+    is "artist" on a venue page and "venue" on an artist page.
+    """
+    return [{
+        prefix + "_id": show.id,
+        prefix + "_name": show.name,
+        prefix + "_image_link": show.image_link,
+        "start_time": show.start_time
+    } for show in shows]
+
+
+def next_cursor(shows, limit):
+    """
+    Return the cursor for the page after `shows`, or None on the last page.
+    """
+    if len(shows) < limit:
+        return None
+    return encode_cursor(shows[-1].start_time, shows[-1].show_id)
+
+
+def search_filter(model, term):
+    """
+    Match a search term against a venue or artist.
+    "City, ST" terms match the location exactly, other terms match
+    partially on name or city, exactly on state, or on a genre.
+    """
+    if "," in term:
+        city, state = [part.strip() for part in term.split(",", 1)]
+        return db.and_(model.city.ilike(city), model.state == state.upper())
+
+    # Genres are stored in their canonical spelling, so "hip-hop" is
+    # looked up as "Hip-Hop" before probing the GIN index.
+    genres = sorted({term, lookup_genre(term) or term})
+    pattern = "%" + term + "%"
+    return db.or_(
+        model.name.ilike(pattern),
+        model.city.ilike(pattern),
+        model.state == term.upper(),
+        model.genres.op("&&")(db.cast(postgresql.array(genres),
+                                      postgresql.ARRAY(db.String))))
+
+
+def search_query(model, term, page, per_page):
+    """
+    Build the ranked search query for venues or artists.
+
+    Each row carries the upcoming show count and the total number of
+    matches, so one query serves a whole page of results.
+    """
+    return db.session.query(
+        model.id,
+        model.name,
+        model.upcoming_shows_count.label('num_upcoming_shows'),
+        db.func.count().over().label('total')
+    ).filter(search_filter(model, term), model.deleted_at.is_(None)) \
+        .order_by(db.func.similarity(model.name, term).desc(), model.name, model.id) \
+        .offset((page - 1) * per_page) \
+        .limit(per_page)
+
+
+def search_results(model, term, page):
+    """
+    Run search_query for one page and shape it for the search templates.
+    """
+    per_page = app.config["SEARCH_RESULTS_PER_PAGE"]
+    rows = search_query(model, term, page, per_page).all()
+    count = rows[0].total if rows else 0
+
+    return {
+        "count": count,
+        "page": page,
+        "pages": math.ceil(count / per_page),
+        "data": [{
+            "id": row.id,
+            "name": row.name,
+            "num_upcoming_shows": row.num_upcoming_shows
+        } for row in rows]
+    }
+
+
+def update_active(model, entity_id, version, values):
+    """
+    Write `values` to a live venue or artist in a single UPDATE, provided
+    it is still at `version`, and bump its version. Nothing is loaded
+    beforehand. Returns the new version, or None if the row was edited
+    or deleted in the meantime, or never existed.
+    """
+    table = model.__table__
+    row = db.session.execute(
+        table.update()
+        .where(table.c.id == entity_id)
+        .where(table.c.version == version)
+        .where(table.c.deleted_at.is_(None))
+        .values(version=table.c.version + 1, **values)
+        .returning(table.c.version)).first()
+    return row.version if row else None
+
+
+def parse_date(value):
+    """
+    Parse a YYYY-MM-DD request argument, raising ValueError if malformed.
+    """
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def shows_page(limit, cursor=None, start=None, end=None, venue_id=None,
+               artist_id=None, genre=None, state=None):
+    """
+    Build the query for one page of the shows feed ordered by
+    (start_time, show_id).
+
+    Only the columns rendered by the shows page are selected, and pages
+    are addressed with a keyset cursor so every page costs the same
+    however deep into the calendar it is.
+    """
+    query = db.session.query(
+        Shows.show_id,
+        Shows.start_time,
+        Shows.venue_id,
+        Venue.name.label('venue_name'),
+        Shows.artist_id,
+        Artist.name.label('artist_name'),
+        Shows.image_link
+    ).join(Venue, Venue.id == Shows.venue_id) \
+        .join(Artist, Artist.id == Shows.artist_id) \
+        .filter(Venue.deleted_at.is_(None), Artist.deleted_at.is_(None))
+
+    if cursor:
+        query = query.filter(
+            db.tuple_(Shows.start_time, Shows.show_id) > db.tuple_(*cursor))
+    if start:
+        query = query.filter(Shows.start_time >= start)
+    if end:
+        query = query.filter(Shows.start_time < end)
+    if venue_id:
+        query = query.filter(Shows.venue_id == venue_id)
+    if artist_id:
+        query = query.filter(Shows.artist_id == artist_id)
+    if genre:
+        # genres @> ARRAY[genre] is answered by the ix_artist_genres GIN index.
+        query = query.filter(Artist.genres.op("@>")(
+            db.cast(postgresql.array([genre]), postgresql.ARRAY(db.String))))
+    if state:
+        query = query.filter(Venue.state == state)
+
+    return query.order_by(Shows.start_time, Shows.show_id).limit(limit)
+
+
+# Free intervals of a venue between :start and :end at least :min_minutes
+# long. Bookings overlapping the range are found through the GiST index of
+# ex_shows_venue_booking; the gap before each booking runs from the latest
+# end of the bookings before it, and a sentinel booking at :end closes the
+# last gap.
+AVAILABILITY_SQL = """
+    WITH bookings AS (
+        SELECT start_time AS starts,
+            start_time + coalesce(duration, 0) * interval '1 minute' AS ends
+        FROM "Shows"
+        WHERE venue_id = :venue_id AND {show_range} && tsrange(:start, :end)
+        UNION ALL
+        SELECT :end, :end
+    ), gaps AS (
+        SELECT greatest(max(ends) OVER (
+                   ORDER BY starts, ends
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+               :start) AS free_from,
+            least(starts, :end) AS free_until
+        FROM bookings
+    )
+    SELECT free_from, free_until FROM gaps
+    WHERE free_until - free_from >= :min_minutes * interval '1 minute'
+    ORDER BY free_from
+""".format(show_range=SHOW_RANGE)
+
+
+def venue_availability(venue_id, start, end, min_minutes):
+    """
+    List the (free_from, free_until) intervals of a venue within
+    [start, end) that can fit a show of `min_minutes`.
+    """
+    return db.session.execute(db.text(AVAILABILITY_SQL), {
+        "venue_id": venue_id, "start": start, "end": end,
+        "min_minutes": min_minutes}).fetchall()
+
+
+# Live venues within :radius metres of a point, nearest first. The box
+# test and the ordering both use the GiST index ix_venue_location, so the
+# scan stops after :limit rows however many venues are in range; the box
+# is a cube around the sphere, hence the exact distance filter.
+NEARBY_SQL = """
+    SELECT id, name, city, state, address,
+        upcoming_shows_count AS num_upcoming_shows,
+        earth_distance(ll_to_earth(:lat, :lon),
+                       ll_to_earth(latitude, longitude)) AS distance
+    FROM "Venue"
+    WHERE deleted_at IS NULL AND latitude IS NOT NULL
+        AND earth_box(ll_to_earth(:lat, :lon), :radius)
+            @> ll_to_earth(latitude, longitude)
+        AND earth_distance(ll_to_earth(:lat, :lon),
+                           ll_to_earth(latitude, longitude)) <= :radius
+    ORDER BY ll_to_earth(latitude, longitude) <-> ll_to_earth(:lat, :lon)
+    LIMIT :limit
+"""
+
+
+def nearby_venues(lat, lon, radius_km, limit):
+    """
+    List the venues within `radius_km` of (lat, lon), nearest first.
+    """
+    return db.session.execute(db.text(NEARBY_SQL), {
+        "lat": lat, "lon": lon, "radius": radius_km * 1000,
+        "limit": limit}).fetchall()
+
+
+def recommendation_artists(artist_ids=None):
+    """
+    Live artists seeking a venue, optionally only those in `artist_ids`.
+    """
+    query = db.session.query(
+        Artist.id, Artist.name, Artist.genres, Artist.city, Artist.state
+    ).filter(Artist.seeking_venue, Artist.deleted_at.is_(None))
+    if artist_ids is not None:
+        query = query.filter(Artist.id.in_(artist_ids))
+    return query.all()
+
+
+def recommendation_venue(venue_id):
+    return db.session.query(Venue.genres, Venue.city, Venue.state) \
+        .filter(Venue.id == venue_id, Venue.deleted_at.is_(None)).first()
+
+
+def recommendation_bookings(venue_id):
+    """
+    Count the past shows of each artist at a venue.
+    """
+    return dict(db.session.query(Shows.artist_id, db.func.count())
+                .filter(Shows.venue_id == venue_id,
+                        Shows.start_time < datetime.now())
+                .group_by(Shows.artist_id))
+
+
+recommender = Recommender(app, load_artists=recommendation_artists,
+                          load_venue=recommendation_venue,
+                          load_bookings=recommendation_bookings)
+
+
+def venue_areas(rows):
+    """
+    Group venue rows ordered by (state, city) into the areas rendered by
+    pages/venues.html. Areas and their venues are generated lazily so
+    rows can come straight from a server-side cursor.
+    """
+    for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
+        yield {
+            "city": city,
+            "state": state,
+            "venues": ({
+                'id': venue.id,
+                'name': venue.name,
+                'num_upcoming_shows': venue.num_upcoming_shows
+            } for venue in venues)
+        }
+
+
+def stream_template(template_name, **context):
+    """
+    Render a template as a streamed response, sending HTML as soon as
+    STREAM_BUFFER_SIZE template chunks are ready instead of building the
+    whole page in memory. Generators in `context` are consumed as the
+    template iterates over them.
+    """
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(app.config["STREAM_BUFFER_SIZE"])
+    return Response(stream_with_context(stream))
+
+
+def wants_json():
+    """
+    Whether to answer with JSON rather than HTML: `?format=json` or
+    `?format=html` wins, otherwise the Accept header decides. Browsers
+    and clients sending no Accept header get HTML.
+    """
+    format = request.args.get("format")
+    if format in ("json", "html"):
+        return format == "json"
+    return request.accept_mimetypes.best_match(
+        ["text/html", "application/json"]) == "application/json"
+
+
+def requested_fields():
+    """
+    Return the fields listed in `?fields=id,name`, or None for all fields.
+    """
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    return frozenset(field.strip() for field in fields.split(",") if field.strip())
+
+
+def pick(record, fields):
+    """
+    Keep the keys of `record` listed in `fields`, or all of them if None.
+    """
+    if fields is None:
+        return record
+    return {key: value for key, value in record.items() if key in fields}
+
+
+def wants(fields, *names):
+    """
+    Whether any of `names` is selected, so detail pages can skip the
+    queries of fields the client did not ask for.
+    """
+    return fields is None or not fields.isdisjoint(names)
+
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -110,61 +653,96 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@cache.cached('venues', 'shows')
 def venues():
-    cities = Venue.query.with_entities(
-        Venue.city, Venue.state).group_by(Venue.state, Venue.city).all()
-
-    data = []
-    for city in cities:
-        venues = Venue.query.filter_by(
-            state=city.state).filter_by(city=city.city)
+    """
+    List every venue grouped by (city, state) along with its number of
+    upcoming shows. The counts are read from the materialized counters,
+    so the directory never touches Shows.
+    """
+    rows = db.session.query(
+        Venue.city,
+        Venue.state,
+        Venue.id,
+        Venue.name,
+        Venue.upcoming_shows_count.label('num_upcoming_shows')
+    ).filter(Venue.deleted_at.is_(None)) \
+        .order_by(Venue.state, Venue.city, Venue.id)
+
+    if wants_json():
+        fields = requested_fields()
+        return jsonify({"areas": [
+            dict(area, venues=[pick(venue, fields) for venue in area["venues"]])
+            for area in venue_areas(rows.all())]})
+
+    if app.config["STREAM_LISTINGS"]:
+        return stream_template('pages/venues.html', areas=venue_areas(
+            rows.yield_per(app.config["STREAM_BATCH_SIZE"])))
+
+    data = [dict(area, venues=list(area["venues"]))
+            for area in venue_areas(rows.all())]
 
-        current_city_venues = []
-        for venue in venues:
-            current_city_venues.append({
-                'id': venue.id,
-                'name': venue.name,
-                'num_upcoming_shows': len([show for show in venue.show if show.start_time > datetime.now()])
-            })
+    return render_template('pages/venues.html', areas=data)
 
-        data.append({
-            "city": city.city,
-            "state": city.state,
-            "venues": current_city_venues
-        })
 
-    return render_template('pages/venues.html', areas=data)
+@app.route('/venues/nearby')
+def venues_nearby():
+    """
+    Return the venues within `radius` km (default NEARBY_DEFAULT_RADIUS_KM)
+    of `lat`, `lon` as JSON, nearest first, with their upcoming show counts.
+    """
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    radius = request.args.get(
+        "radius", app.config["NEARBY_DEFAULT_RADIUS_KM"], type=float)
+    if lat is None or lon is None or not -90 <= lat <= 90 or \
+            not -180 <= lon <= 180 or radius <= 0:
+        abort(400)
+    radius = min(radius, app.config["NEARBY_MAX_RADIUS_KM"])
+
+    fields = requested_fields()
+    rows = nearby_venues(lat, lon, radius, app.config["NEARBY_LIMIT"])
+
+    return jsonify({"venues": [pick({
+        "id": row.id,
+        "name": row.name,
+        "city": row.city,
+        "state": row.state,
+        "address": row.address,
+        "distance_km": round(row.distance / 1000, 3),
+        "num_upcoming_shows": row.num_upcoming_shows,
+    }, fields) for row in rows]})
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
 
-    word = "%" + request.form.get("search_term", "") + "%"
-
-    venues = Venue.query.filter(Venue.name.ilike(word))
+    search_term = request.form.get("search_term", "").strip()
+    page = max(request.form.get("page", 1, type=int), 1)
 
-    data = []
-
-    for venue in venues:
-        data.append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len([show for show in venue.show if show.start_time > datetime.now()])
-        })
+    response = search_results(Venue, search_term, page)
 
-    response = {
-        "count": len(data),
-        "data": data
-    }
+    if wants_json():
+        fields = requested_fields()
+        return jsonify(dict(response, data=[
+            pick(venue, fields) for venue in response["data"]]))
 
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
 @app.route('/venues/<int:venue_id>')
+@cache.cached('venues', 'artists', 'shows')
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
 
-    venue = Venue.query.get(venue_id)
+    venue = Venue.get_active(venue_id)
+
+    if not venue:
+        abort(404)
+
+    as_json = wants_json()
+    fields = requested_fields() if as_json else None
+    now = datetime.now()
 
     data = {
         "id": venue.id,
@@ -179,37 +757,115 @@ def show_venue(venue_id):
         "seeking_talent": venue.seeking_talent,
         "seeking_description": venue.seeking_description,
         "image_link": venue.image_link,
-        "past_shows": [],
-        "upcoming_shows": [],
-        "past_shows_count": 0,
-        "upcoming_shows_count": 0,
     }
 
-    for show in venue.show:
-        artist = show.artist
-        if(show.start_time <= datetime.now()):
-            data['past_shows'].append({
-                "artist_id": artist.id,
-                "artist_name": artist.name,
-                "artist_image_link": artist.image_link,
-                "start_time": show.start_time.strftime('%Y-%m-%d %H:%S:%M')
-            })
-            data['past_shows_count'] += 1
-        else:
-            data['upcoming_shows'].append({
-                "artist_id": artist.id,
-                "artist_name": artist.name,
-                "artist_image_link": artist.image_link,
-                "start_time": show.start_time.strftime('%Y-%m-%d %H:%S:%M')
-            })
-            data['upcoming_shows_count'] += 1
+    if wants(fields, "past_shows_count", "upcoming_shows_count"):
+        counts = show_counts(Shows.venue_id, venue_id, Artist, now)
+        data["past_shows_count"] = counts.past_shows_count
+        data["upcoming_shows_count"] = counts.upcoming_shows_count
+
+    if wants(fields, "past_shows", "past_shows_cursor"):
+        past_limit = app.config["PAST_SHOWS_LIMIT"]
+        past_shows = partitioned_shows(
+            Shows.venue_id, venue_id, Artist, now, False, past_limit)
+        data["past_shows"] = format_shows(past_shows, "artist")
+        data["past_shows_cursor"] = next_cursor(past_shows, past_limit)
+
+    if wants(fields, "upcoming_shows"):
+        upcoming_shows = partitioned_shows(
+            Shows.venue_id, venue_id, Artist, now, True,
+            app.config["UPCOMING_SHOWS_LIMIT"])
+        data["upcoming_shows"] = format_shows(upcoming_shows, "artist")
+
+    if as_json:
+        return jsonify(pick(data, fields))
 
     return render_template('pages/show_venue.html', venue=data)
 
+
+@app.route('/venues/<int:venue_id>/past_shows')
+@cache.cached('artists', 'shows')
+def venue_past_shows(venue_id):
+    """
+    Return the next page of past shows of a venue as JSON,
+    starting after the show identified by the `cursor` argument.
+    """
+    if not Venue.get_active(venue_id):
+        abort(404)
+
+    limit = app.config["PAST_SHOWS_LIMIT"]
+    shows = partitioned_shows(Shows.venue_id, venue_id, Artist, datetime.now(),
+                              False, limit, decode_cursor(request.args.get("cursor")))
+
+    data = format_shows(shows, "artist")
+    for show in data:
+        show["start_time"] = format_datetime(show["start_time"], 'full')
+
+    return jsonify({
+        "shows": data,
+        "cursor": next_cursor(shows, limit)
+    })
+
+@app.route('/venues/<int:venue_id>/availability')
+@cache.cached('venues', 'shows')
+def venue_free_slots(venue_id):
+    """
+    Return the free slots of a venue between `start` and `end` (inclusive,
+    YYYY-MM-DD, defaulting to the next 30 days) as JSON. Only slots of at
+    least `min_minutes` (default one show) are listed.
+    """
+    if not Venue.get_active(venue_id):
+        abort(404)
+
+    try:
+        start = parse_date(request.args["start"]) if "start" in request.args \
+            else datetime.now().replace(second=0, microsecond=0)
+        end = parse_date(request.args["end"]) + timedelta(days=1) \
+            if "end" in request.args else start + timedelta(days=30)
+    except ValueError:
+        abort(400)
+    min_minutes = max(request.args.get(
+        "min_minutes", DEFAULT_SHOW_DURATION, type=int), 1)
+
+    slots = venue_availability(venue_id, start, end, min_minutes)
+
+    return jsonify({
+        "venue_id": venue_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "slots": [{"start": slot.free_from.isoformat(),
+                   "end": slot.free_until.isoformat()} for slot in slots]
+    })
+
+@app.route('/venues/<int:venue_id>/recommended-artists')
+def venue_recommended_artists(venue_id):
+    """
+    Return the artists seeking a venue that best match this one as JSON,
+    best first. See Recommender for the scoring.
+    """
+    ranking = recommender.recommend(venue_id)
+    if ranking is None:
+        abort(404)
+
+    fields = requested_fields()
+    return jsonify({
+        "venue_id": venue_id,
+        "artists": [pick(artist._asdict(), fields) for artist in ranking]
+    })
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
 
+def flash_not_geocoded(city, state):
+    """
+    Tell that a venue was saved without coordinates, so it is missing
+    from /venues/nearby until its city is added to the centroids file.
+    """
+    flash('{}, {} is not in the list of known cities, so the venue will '
+          'not show up in nearby searches.'.format(city, state.upper()))
+
+
 @app.route('/venues/create', methods=['GET'])
 def create_venue_form():
     form = VenueForm()
@@ -227,10 +883,10 @@ def create_venue_submission():
     try:
         venue = Venue(name=request.form["name"],
                       city=request.form["city"],
-                      state=request.form["state"],
+                      state=clean_state(request.form["state"]),
                       address=request.form["address"],
                       phone=request.form["phone"],
-                      genres=request.form.getlist("genres"),
+                      genres=clean_genres(request.form.getlist("genres")),
                       image_link=request.form.get("image_link"),
                       website=request.form.get("website"),
                       seeking_talent=True if request.form.get(
@@ -239,11 +895,13 @@ def create_venue_submission():
                           "seeking_description"),
                       facebook_link=request.form["facebook_link"]
                       )
+        venue.geocode()
 
         # Add new venue to the Database
         db.session.add(venue)
         # Commit the changes to the database
         db.session.commit()
+        cache.invalidate('venues')
     except:
         # Set error flag to true
         error = True
@@ -259,18 +917,26 @@ def create_venue_submission():
         else:
             flash('Venue ' + request.form['name'] +
                   ' was successfully listed!')
+            if venue.latitude is None:
+                flash_not_geocoded(venue.city, venue.state)
     # Redirect to home page
     return render_template('pages/home.html')
 
 
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-
+    """
+    Soft delete a venue. Its row and shows are removed later by
+    `flask purge-deleted`, so this returns at once however many shows
+    the venue has.
+    """
     error = False
 
     try:
-        Venue.query.filter_by(id=venue_id).delete()
+        soft_delete(Venue, venue_id)
         db.session.commit()
+        cache.invalidate('venues', 'artists', 'shows')
+        recommender.venue_changed(int(venue_id))
     except:
         error = True
         db.session.rollback()
@@ -279,15 +945,30 @@ def delete_venue(venue_id):
         if error:
             flash('An error occurred. Venue with ' +
                   venue_id + ' could not be deleted.')
-    flash('Venue was deleted listed!')
+        else:
+            flash('Venue was deleted listed!')
 
     return render_template('pages/home.html')
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@cache.cached('artists')
 def artists():
-    all_artists = Artist.query.with_entities(Artist.id, Artist.name).all()
+    all_artists = Artist.query.with_entities(
+        Artist.id, Artist.name).filter(Artist.deleted_at.is_(None)) \
+        .order_by(Artist.id)
+
+    if wants_json():
+        fields = requested_fields()
+        return jsonify({"artists": [
+            pick({"id": artist.id, "name": artist.name}, fields)
+            for artist in all_artists]})
+
+    if app.config["STREAM_LISTINGS"]:
+        return stream_template('pages/artists.html', artists=(
+            {"id": artist.id, "name": artist.name}
+            for artist in all_artists.yield_per(app.config["STREAM_BATCH_SIZE"])))
 
     data = []
     for artist in all_artists:
@@ -302,31 +983,31 @@ def artists():
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
 
-    word = "%" + request.form.get("search_term", "") + "%"
-
-    artists = Artist.query.filter(Artist.name.ilike(word))
+    search_term = request.form.get("search_term", "").strip()
+    page = max(request.form.get("page", 1, type=int), 1)
 
-    data = []
-
-    for artist in artists:
-        data.append({
-            "id": artist.id,
-            "name": artist.name,
-            "num_upcoming_shows": len([show for show in artist.show if show.start_time > datetime.now()])
-        })
+    response = search_results(Artist, search_term, page)
 
-    response = {
-        "count": len(data),
-        "data": data
-    }
+    if wants_json():
+        fields = requested_fields()
+        return jsonify(dict(response, data=[
+            pick(artist, fields) for artist in response["data"]]))
 
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
 @app.route('/artists/<int:artist_id>')
+@cache.cached('venues', 'artists', 'shows')
 def show_artist(artist_id):
 
-    artist = Artist.query.get(artist_id)
+    artist = Artist.get_active(artist_id)
+
+    if not artist:
+        abort(404)
+
+    as_json = wants_json()
+    fields = requested_fields() if as_json else None
+    now = datetime.now()
 
     data = {
         "id": artist_id,
@@ -340,43 +1021,68 @@ def show_artist(artist_id):
         "seeking_venue": artist.seeking_venue,
         "seeking_description": artist.seeking_description,
         "image_link": artist.image_link,
-        "past_shows": [],
-        "upcoming_shows": [],
-        "past_shows_count": 0,
-        "upcoming_shows_count": 0,
     }
 
-    for show in artist.show:
-        venue = show.venue
-        if show.start_time <= datetime.now():
-            data['past_shows'].append({
-                "venue_id": venue.id,
-                "venue_name": venue.name,
-                "venue_image_link": venue.image_link,
-                "start_time": show.start_time.strftime('%Y-%m-%d %H:%S:%M')
-            })
-            data['past_shows_count'] += 1
-        else:
-            data['upcoming_shows'].append({
-                "venue_id": venue.id,
-                "venue_name": venue.name,
-                "venue_image_link": venue.image_link,
-                "start_time": show.start_time.strftime('%Y-%m-%d %H:%S:%M')
-            })
-            data['upcoming_shows_count'] += 1
+    if wants(fields, "past_shows_count", "upcoming_shows_count"):
+        counts = show_counts(Shows.artist_id, artist_id, Venue, now)
+        data["past_shows_count"] = counts.past_shows_count
+        data["upcoming_shows_count"] = counts.upcoming_shows_count
+
+    if wants(fields, "past_shows", "past_shows_cursor"):
+        past_limit = app.config["PAST_SHOWS_LIMIT"]
+        past_shows = partitioned_shows(
+            Shows.artist_id, artist_id, Venue, now, False, past_limit)
+        data["past_shows"] = format_shows(past_shows, "venue")
+        data["past_shows_cursor"] = next_cursor(past_shows, past_limit)
+
+    if wants(fields, "upcoming_shows"):
+        upcoming_shows = partitioned_shows(
+            Shows.artist_id, artist_id, Venue, now, True,
+            app.config["UPCOMING_SHOWS_LIMIT"])
+        data["upcoming_shows"] = format_shows(upcoming_shows, "venue")
+
+    if as_json:
+        return jsonify(pick(data, fields))
 
     return render_template('pages/show_artist.html', artist=data)
 
 
+@app.route('/artists/<int:artist_id>/past_shows')
+@cache.cached('venues', 'shows')
+def artist_past_shows(artist_id):
+    """
+    Return the next page of past shows of an artist as JSON,
+    starting after the show identified by the `cursor` argument.
+    """
+    if not Artist.get_active(artist_id):
+        abort(404)
+
+    limit = app.config["PAST_SHOWS_LIMIT"]
+    shows = partitioned_shows(Shows.artist_id, artist_id, Venue, datetime.now(),
+                              False, limit, decode_cursor(request.args.get("cursor")))
+
+    data = format_shows(shows, "venue")
+    for show in data:
+        show["start_time"] = format_datetime(show["start_time"], 'full')
+
+    return jsonify({
+        "shows": data,
+        "cursor": next_cursor(shows, limit)
+    })
+
+
 @app.route('/artists/<artist_id>', methods=['DELETE'])
 def delete_artist(artist_id):
-
+    """
+    Soft delete an artist, see delete_venue.
+    """
     error = False
 
-    print(artist_id)
     try:
-        Artist.query.filter_by(id=artist_id).delete()
+        soft_delete(Artist, artist_id)
         db.session.commit()
+        cache.invalidate('venues', 'artists', 'shows')
+        recommender.artist_changed(int(artist_id))
     except:
         error = True
         db.session.rollback()
@@ -384,19 +1090,75 @@ def delete_artist(artist_id):
         db.session.close()
         if error:
             flash('An error occurred. Artists with ' +
-                  venue_id + ' could not be deleted.')
-    flash('Artist was deleted listed!')
+                  artist_id + ' could not be deleted.')
+        else:
+            flash('Artist was deleted listed!')
 
     return render_template('pages/home.html')
 
 
 #  Update
 #  ----------------------------------------------------------------
+def parse_flag(value):
+    """
+    Read a yes/no form field; the edit forms send "Yes" or "No".
+    """
+    return value.strip().lower() not in ("", "no", "n", "false", "0")
+
+
+# Columns an edit form may change, with the function cleaning each value.
+# genres is multi-valued and read separately.
+ARTIST_EDIT_FIELDS = {
+    "name": str,
+    "city": str,
+    "state": clean_state,
+    "phone": str,
+    "website": str,
+    "facebook_link": str,
+    "seeking_venue": parse_flag,
+    "seeking_description": str,
+}
+
+VENUE_EDIT_FIELDS = {
+    "name": str,
+    "city": str,
+    "state": clean_state,
+    "address": str,
+    "phone": str,
+    "website": str,
+    "facebook_link": str,
+    "seeking_talent": parse_flag,
+    "seeking_description": str,
+}
+
+
+def submitted_values(fields):
+    """
+    Clean the edit form fields present in the request. Fields left out
+    of the form are left out of the UPDATE, not blanked.
+    """
+    values = {field: clean(request.form[field])
+              for field, clean in fields.items() if field in request.form}
+    if "genres" in request.form:
+        values["genres"] = clean_genres(request.form.getlist("genres"))
+    return values
+
+
+def submitted_version():
+    version = request.form.get("version", type=int)
+    if version is None:
+        raise ValueError("The form carries no version")
+    return version
+
+
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     form = ArtistForm()
 
-    artist = Artist.query.get(artist_id)
+    artist = Artist.get_active(artist_id)
+
+    if not artist:
+        abort(404)
 
     artist = {
         "id": artist_id,
@@ -410,6 +1172,7 @@ def edit_artist(artist_id):
         "seeking_venue": "Yes" if artist.seeking_venue == True else "No",
         "seeking_description": artist.seeking_description if artist.seeking_venue == True else "",
         "image_link": artist.image_link,
+        "version": artist.version,
     }
 
     return render_template('forms/edit_artist.html', form=form, artist=artist)
@@ -417,22 +1180,18 @@ def edit_artist(artist_id):
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-
-    error = False
+    """
+    Save the submitted fields of an artist in one UPDATE, unless someone
+    else edited the artist since the form was rendered.
+    """
+    error = conflict = False
     try:
-        artist = Artist.query.get(artist_id)
-        artist.name = request.form["name"]
-        artist.city = request.form["city"]
-        artist.state = request.form["state"]
-        artist.phone = request.form["phone"]
-        artist.genres = request.form.getlist("genres")
-        artist.website = request.form.get("website")
-        artist.seeking_venue = True if request.form.get(
-            "seeking_venue") else False
-        artist.seeking_description = request.form.get("seeking_description")
-        artist.facebook_link = request.form["facebook_link"]
-
+        conflict = update_active(Artist, artist_id, submitted_version(),
+                                 submitted_values(ARTIST_EDIT_FIELDS)) is None
         db.session.commit()
+        if not conflict:
+            cache.invalidate('artists')
+            recommender.artist_changed(artist_id)
     except:
         # Set error flag to true
         error = True
@@ -444,6 +1203,12 @@ def edit_artist_submission(artist_id):
         if error:
             flash('An error occurred. Artist ' +
                   request.form["name"] + ' could not be edited.')
+        elif conflict:
+            flash('Artist ' + request.form["name"] + ' was changed by someone '
+                  'else in the meantime. Review the changes and edit again.')
+
+    if conflict:
+        return redirect(url_for('edit_artist', artist_id=artist_id))
     return redirect(url_for('show_artist', artist_id=artist_id))
 
 
@@ -451,7 +1216,10 @@ def edit_artist_submission(artist_id):
 def edit_venue(venue_id):
     form = VenueForm()
 
-    venue = Venue.query.get(venue_id)
+    venue = Venue.get_active(venue_id)
+
+    if not venue:
+        abort(404)
 
     venue = {
         "id": venue_id,
@@ -466,6 +1234,7 @@ def edit_venue(venue_id):
         "seeking_talent": "Yes" if venue.seeking_talent == True else "No",
         "seeking_description": venue.seeking_description if venue.seeking_talent == True else "",
         "image_link": venue.image_link,
+        "version": venue.version,
     }
 
     return render_template('forms/edit_venue.html', form=form, venue=venue)
@@ -473,25 +1242,34 @@ def edit_venue(venue_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-
-    error = False
+    """
+    Save the submitted fields of a venue in one UPDATE, unless someone
+    else edited the venue since the form was rendered.
+    """
+    error = conflict = located = False
     try:
-        venue = Venue.query.get(venue_id)
-
-        venue.name = request.form["name"]
-        venue.city = request.form["city"]
-        venue.state = request.form["state"]
-        venue.address = request.form["address"]
-        venue.phone = request.form["phone"]
-        venue.genres = request.form.getlist("genres")
-        venue.website = request.form.get("website")
-        venue.seeking_talent = True if request.form.get(
-            "seeking_talent") else False
-        venue.seeking_description = request.form.get("seeking_description")
-        venue.facebook_link = request.form["facebook_link"]
-
+        values = submitted_values(VENUE_EDIT_FIELDS)
+        if "city" in values or "state" in values:
+            if "city" not in values or "state" not in values:
+                # Only one of them changed; the other comes from the row,
+                # and update_active() refuses the edit if it moved since.
+                stored = db.session.query(Venue.city, Venue.state) \
+                    .filter(Venue.id == venue_id).first()
+                if stored is not None:
+                    values.setdefault("city", stored.city)
+                    values.setdefault("state", stored.state)
+            if "city" in values and "state" in values:
+                values["latitude"], values["longitude"] = \
+                    geocoder.locate(values["city"], values["state"]) or (None, None)
+                located = True
+
+        conflict = update_active(Venue, venue_id, submitted_version(),
+                                 values) is None
         # Commit the changes to the database
         db.session.commit()
+        if not conflict:
+            cache.invalidate('venues')
+            recommender.venue_changed(venue_id)
     except:
         # Set error flag to true
         error = True
@@ -503,7 +1281,14 @@ def edit_venue_submission(venue_id):
         if error:
             flash('An error occurred. Venue ' +
                   request.form["name"] + ' could not be edited.')
-
+        elif conflict:
+            flash('Venue ' + request.form["name"] + ' was changed by someone '
+                  'else in the meantime. Review the changes and edit again.')
+        elif located and values["latitude"] is None:
+            flash_not_geocoded(values["city"], values["state"])
+
+    if conflict:
+        return redirect(url_for('edit_venue', venue_id=venue_id))
     return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
@@ -523,9 +1308,9 @@ def create_artist_submission():
     try:
         artist = Artist(name=request.form["name"],
                         city=request.form["city"],
-                        state=request.form["state"],
+                        state=clean_state(request.form["state"]),
                         phone=request.form["phone"],
-                        genres=request.form.getlist("genres"),
+                        genres=clean_genres(request.form.getlist("genres")),
                         image_link=request.form.get("image_link"),
                         website=request.form.get("website"),
                         seeking_venue=True if request.form.get(
@@ -538,6 +1323,8 @@ def create_artist_submission():
         db.session.add(artist)
         # Commit the changes to the database
         db.session.commit()
+        cache.invalidate('artists')
+        recommender.artist_changed(artist.id)
     except:
         # Set error flag to true
         error = True
@@ -560,21 +1347,105 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@cache.cached('venues', 'artists', 'shows')
 def shows():
+    """
+    List shows page by page, optionally filtered by a date range
+    (`from` and `to`, inclusive, as YYYY-MM-DD), `venue_id`, `artist_id`,
+    artist `genre` or venue `state`.
+    """
+    return render_shows(shows_filters())
 
-    data = []
 
-    for show in Shows.query.all():
-        data.append({
-            "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
-            "artist_id": show.artist_id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.image_link,
-            "start_time": str(show.start_time)
-        })
+@app.route('/genres/<genre>/shows')
+@cache.cached('venues', 'artists', 'shows')
+def genre_shows(genre):
+    """
+    List the upcoming shows of artists playing `genre`, optionally at
+    venues of one `state`, e.g. /genres/jazz/shows?state=CA.
+    """
+    filters = shows_filters()
+    filters["genre"] = lookup_genre(genre)
+    if filters["genre"] is None:
+        abort(404)
+    filters["start"] = max(filters["start"] or datetime.min, datetime.now())
+    return render_shows(filters, genre=filters["genre"])
 
-    return render_template('pages/shows.html', shows=data)
+
+def shows_filters():
+    """
+    Read the shows feed filters from the query string. Unknown genres
+    and states are rejected with a 404.
+    """
+    filters = {
+        "start": request.args.get("from", type=parse_date),
+        "end": request.args.get("to", type=parse_date),
+        "venue_id": request.args.get("venue_id", type=int),
+        "artist_id": request.args.get("artist_id", type=int),
+        "genre": request.args.get("genre"),
+        "state": request.args.get("state"),
+    }
+    if filters["end"]:
+        filters["end"] += timedelta(days=1)
+    if filters["genre"]:
+        filters["genre"] = lookup_genre(filters["genre"])
+        if filters["genre"] is None:
+            abort(404)
+    if filters["state"]:
+        try:
+            filters["state"] = clean_state(filters["state"])
+        except ValueError:
+            abort(404)
+    return filters
+
+
+def render_shows(filters, **context):
+    """
+    Render one page of the shows feed matching `filters`, streamed when
+    STREAM_LISTINGS is on, or return it as JSON.
+    """
+    limit = app.config["SHOWS_PER_PAGE"]
+
+    rows = shows_page(limit, decode_cursor(
+        request.args.get("cursor")), **filters)
+
+    last = {"count": 0, "show": None}
+
+    def format_rows(rows):
+        for show in rows:
+            last["count"] += 1
+            last["show"] = show
+            yield {
+                "venue_id": show.venue_id,
+                "venue_name": show.venue_name,
+                "artist_id": show.artist_id,
+                "artist_name": show.artist_name,
+                "artist_image_link": show.image_link,
+                "start_time": show.start_time
+            }
+
+    def next_page():
+        # Only known once every row of the page has been rendered.
+        if last["count"] < limit:
+            return None
+        args = dict(request.view_args, **request.args.to_dict())
+        args["cursor"] = encode_cursor(
+            last["show"].start_time, last["show"].show_id)
+        return url_for(request.endpoint, **args)
+
+    if wants_json():
+        fields = requested_fields()
+        data = [pick(show, fields) for show in format_rows(rows)]
+        return jsonify({"shows": data, "next": next_page()})
+
+    if app.config["STREAM_LISTINGS"]:
+        return stream_template('pages/shows.html', next_page=next_page, shows=format_rows(
+            rows.yield_per(app.config["STREAM_BATCH_SIZE"])), **context)
+
+    data = list(format_rows(rows))
+
+    return render_template('pages/shows.html', shows=data, next_page=next_page(),
+                           **context)
 
 
 @app.route('/shows/create')
@@ -587,17 +1458,30 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     error = False
+    conflict = False
 
     try:
+        if not Venue.get_active(request.form["venue_id"]) or \
+                not Artist.get_active(request.form["artist_id"]):
+            raise ValueError("Venue or artist does not exist")
         show = Shows(venue_id=request.form["venue_id"],
                      artist_id=request.form["artist_id"],
                      start_time=request.form["start_time"],
+                     duration=request.form.get(
+                         "duration", DEFAULT_SHOW_DURATION, type=int),
                      image_link=request.form.get("image_link")
                      )
         # Add new artist to the Database
         db.session.add(show)
         # Commit the changes to the database
         db.session.commit()
+        cache.invalidate('shows')
+        recommender.venue_changed(int(request.form["venue_id"]))
+    except IntegrityError as e:
+        error = True
+        # exclusion_violation: the venue or the artist is already booked.
+        conflict = e.orig.pgcode == '23P01'
+        db.session.rollback()
     except:
         # Set error flag to true
         error = True
@@ -606,7 +1490,10 @@ def create_show_submission():
         print(sys.exc_info())
     finally:
         # Show error mesaage to user
-        if error:
+        if conflict:
+            flash('Show could not be listed. The venue or the artist is '
+                  'already booked at that time.')
+        elif error:
             flash('An error occurred. Show could not be listed.')
         # Show success mesaage to user
         else:
@@ -615,6 +1502,33 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+#  Internal
+#  ----------------------------------------------------------------
+
+@app.before_request
+def restrict_internal():
+    if request.path.startswith('/_internal/') and \
+            request.remote_addr not in app.config["INTERNAL_ALLOWED_ADDRS"]:
+        abort(404)
+
+
+@app.route('/_internal/pool')
+def pool_stats():
+    """
+    Connection pool state and counters of this worker process.
+    """
+    return jsonify(pool_metrics.snapshot(db.engine.pool))
+
+
+@app.route('/_internal/metrics')
+def metrics():
+    """
+    Pool metrics of this worker process for a Prometheus scraper.
+    """
+    return Response(pool_metrics.render(db.engine.pool),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -625,16 +1539,770 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+log_handler = FileHandler(app.config["LOG_FILE"]) if app.config["LOG_FILE"] \
+    else StreamHandler()
+log_handler.setFormatter(
+    Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+)
+log_handler.setLevel(app.config["LOG_LEVEL"])
+app.logger.removeHandler(default_handler)
+for logger in (app.logger, logging.getLogger('fyyur')):
+    logger.setLevel(app.config["LOG_LEVEL"])
+    logger.addHandler(log_handler)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+def without_statement_timeout():
+    """
+    Lift DB_STATEMENT_TIMEOUT for the current transaction, for commands
+    that legitimately run long statements over the whole dataset.
+    """
+    db.session.execute("SET LOCAL statement_timeout = 0")
+
+
+SEED_CITIES = [
+    ("San Francisco", "CA"), ("Los Angeles", "CA"), ("New York", "NY"),
+    ("Brooklyn", "NY"), ("Austin", "TX"), ("Houston", "TX"),
+    ("Chicago", "IL"), ("Seattle", "WA"), ("Portland", "OR"),
+    ("Nashville", "TN"), ("New Orleans", "LA"), ("Denver", "CO"),
+]
+
+SEED_GENRES = [
+    "Alternative", "Blues", "Classical", "Country", "Electronic", "Folk",
+    "Funk", "Hip-Hop", "Heavy Metal", "Instrumental", "Jazz",
+    "Musical Theatre", "Pop", "Punk", "R&B", "Reggae", "Rock n Roll", "Soul",
+]
+
+
+@app.cli.command("seed")
+@click.option("--venues", default=1000, help="Number of venues to add.")
+@click.option("--artists", default=1000, help="Number of artists to add.")
+@click.option("--shows", default=10000, help="Number of shows to add.")
+def seed(venues, artists, shows):
+    """
+    Fill the database with a deterministic synthetic dataset.
+    Rows are generated in Postgres, so millions of rows take seconds.
+    """
+    without_statement_timeout()
+    params = {
+        "cities": [city for city, _ in SEED_CITIES],
+        "states": [state for _, state in SEED_CITIES],
+        "genres": SEED_GENRES,
+        "latitudes": [geocoder.locate(*city)[0] for city in SEED_CITIES],
+        "longitudes": [geocoder.locate(*city)[1] for city in SEED_CITIES],
+    }
+
+    for table, count in (("Venue", venues), ("Artist", artists)):
+        # Venues are placed at the centroid of their city right away.
+        extra_columns = ", address, latitude, longitude" if table == "Venue" else ""
+        extra_values = (", i || ' Main St', (:latitudes)[1 + i % cardinality(:cities)], "
+                        "(:longitudes)[1 + i % cardinality(:cities)]"
+                        if table == "Venue" else "")
+        seeking = "seeking_talent" if table == "Venue" else "seeking_venue"
+        db.session.execute(db.text("""
+            INSERT INTO "{table}" (name, city, state, phone, genres,
+                image_link, facebook_link, {seeking}{extra_columns})
+            SELECT '{table} ' || initcap(substr(md5(i::text), 1, 10)),
+                (:cities)[1 + i % cardinality(:cities)],
+                (:states)[1 + i % cardinality(:states)],
+                '555-' || lpad((i % 10000)::text, 4, '0'),
+                ARRAY[(:genres)[1 + i % cardinality(:genres)],
+                      (:genres)[1 + (i / 7) % cardinality(:genres)]],
+                'https://images.unsplash.com/photo-1534294668821-28a3054f4256',
+                'https://www.facebook.com/' || i,
+                i % 3 = 0{extra_values}
+            FROM generate_series(1, :count) AS i
+        """.format(table=table, seeking=seeking, extra_columns=extra_columns,
+                   extra_values=extra_values)), dict(params, count=count))
+        click.echo("Added {} {} rows".format(count, table))
+
+    # Shows are spread over two years centred on today so both the past
+    # and upcoming partitions are populated.
+    db.session.execute(db.text("""
+        WITH venue_ids AS (
+            SELECT array_agg(id ORDER BY id) AS ids FROM "Venue"
+            WHERE deleted_at IS NULL
+        ), artist_ids AS (
+            SELECT array_agg(id ORDER BY id) AS ids FROM "Artist"
+            WHERE deleted_at IS NULL
+        )
+        INSERT INTO "Shows" (venue_id, artist_id, start_time, image_link)
+        SELECT venue_ids.ids[1 + (i::bigint * 7919) % cardinality(venue_ids.ids)],
+            artist_ids.ids[1 + (i::bigint * 104729) % cardinality(artist_ids.ids)],
+            date_trunc('hour', now()) - interval '365 days'
+                + (i % 730) * interval '1 day' + (i % 12) * interval '1 hour',
+            'https://images.unsplash.com/photo-1534294668821-28a3054f4256'
+        FROM generate_series(1, :count) AS i, venue_ids, artist_ids
+        ON CONFLICT DO NOTHING
+    """), {"count": shows})
+    click.echo("Added up to {} Shows rows".format(shows))
+
+    db.session.commit()
+    cache.invalidate('venues', 'artists', 'shows')
+
+
+#  Bulk import and export
+#  ----------------------------------------------------------------
+
+IMPORT_COLUMNS = {
+    "venues": ["name", "city", "state", "address", "phone", "genres",
+               "image_link", "website", "seeking_talent",
+               "seeking_description", "facebook_link"],
+    "artists": ["name", "city", "state", "phone", "genres", "image_link",
+                "website", "seeking_venue", "seeking_description",
+                "facebook_link"],
+    "shows": ["venue_id", "venue_name", "artist_id", "artist_name",
+              "start_time", "duration", "image_link"],
+}
+
+# Columns cast from text by IMPORT_SQL, checked and normalized before
+# staging so that a malformed value skips its row instead of failing the
+# chunk's INSERT.
+IMPORT_TYPES = {
+    "venue_id": "integer",
+    "artist_id": "integer",
+    "duration": "integer",
+    "start_time": "timestamp",
+    "seeking_talent": "boolean",
+    "seeking_venue": "boolean",
+}
+
+BOOLEAN_VALUES = {
+    "true": "true", "t": "true", "yes": "true", "y": "true", "on": "true",
+    "1": "true",
+    "false": "false", "f": "false", "no": "false", "n": "false",
+    "off": "false", "0": "false",
+}
+
+
+def normalize_import_value(kind, value):
+    """
+    Return `value` as text Postgres casts to `kind` without error, or
+    raise ValueError. Timestamps lose their time zone, as the cast does.
+    """
+    if isinstance(value, bool):
+        if kind != "boolean":
+            raise ValueError(value)
+        return "true" if value else "false"
+    text = str(value).strip()
+    if kind == "integer":
+        number = int(text)
+        if not -2 ** 31 <= number < 2 ** 31:
+            raise ValueError(value)
+        return str(number)
+    if kind == "timestamp":
+        try:
+            parsed = dateutil.parser.isoparse(text)
+        except ValueError:
+            parsed = dateutil.parser.parse(text)
+        return parsed.replace(tzinfo=None).isoformat()
+    return BOOLEAN_VALUES[text.lower()]
+
+
+# Move one chunk of staged text rows into the real tables. Rows missing
+# required values or referencing unknown venues/artists are skipped, and
+# shows overlapping another booking of their venue or artist are ignored.
+IMPORT_SQL = {
+    "venues": """
+        INSERT INTO "Venue" (name, city, state, address, phone, genres,
+            image_link, website, seeking_talent, seeking_description,
+            facebook_link)
+        SELECT name, city, state, address, phone,
+            string_to_array(genres, ','),
+            coalesce(image_link, :image_link), website,
+            coalesce(seeking_talent::boolean, false), seeking_description,
+            facebook_link
+        FROM import_staging
+        WHERE name IS NOT NULL AND city IS NOT NULL AND state IS NOT NULL
+            AND address IS NOT NULL AND phone IS NOT NULL
+            AND genres IS NOT NULL AND facebook_link IS NOT NULL
+    """,
+    "artists": """
+        INSERT INTO "Artist" (name, city, state, phone, genres, image_link,
+            website, seeking_venue, seeking_description, facebook_link)
+        SELECT name, city, state, phone, string_to_array(genres, ','),
+            coalesce(image_link, :image_link), website,
+            coalesce(seeking_venue::boolean, false), seeking_description,
+            facebook_link
+        FROM import_staging
+        WHERE name IS NOT NULL AND city IS NOT NULL AND state IS NOT NULL
+            AND phone IS NOT NULL AND genres IS NOT NULL
+            AND facebook_link IS NOT NULL
+    """,
+    "shows": """
+        WITH venue_names AS (
+            SELECT DISTINCT ON (v.name) v.name, v.id
+            FROM "Venue" v
+            WHERE v.name IN (SELECT venue_name FROM import_staging)
+                AND v.deleted_at IS NULL
+            ORDER BY v.name, v.id
+        ), artist_names AS (
+            SELECT DISTINCT ON (a.name) a.name, a.id
+            FROM "Artist" a
+            WHERE a.name IN (SELECT artist_name FROM import_staging)
+                AND a.deleted_at IS NULL
+            ORDER BY a.name, a.id
+        )
+        INSERT INTO "Shows" (venue_id, artist_id, start_time, duration,
+            image_link)
+        SELECT v.id, a.id, s.start_time::timestamp,
+            coalesce(s.duration::integer, :duration),
+            coalesce(s.image_link, :image_link)
+        FROM import_staging s
+        LEFT JOIN venue_names vn ON vn.name = s.venue_name
+        LEFT JOIN artist_names an ON an.name = s.artist_name
+        JOIN "Venue" v ON v.id = coalesce(s.venue_id::integer, vn.id)
+        JOIN "Artist" a ON a.id = coalesce(s.artist_id::integer, an.id)
+        WHERE s.start_time IS NOT NULL
+            AND v.deleted_at IS NULL AND a.deleted_at IS NULL
+        ON CONFLICT DO NOTHING
+    """,
+}
+
+EXPORT_SQL = {
+    "venues": """
+        SELECT id, name, city, state, address, phone,
+            array_to_string(genres, ',') AS genres, image_link, website,
+            seeking_talent, seeking_description, facebook_link
+        FROM "Venue" WHERE deleted_at IS NULL ORDER BY id
+    """,
+    "artists": """
+        SELECT id, name, city, state, phone,
+            array_to_string(genres, ',') AS genres, image_link, website,
+            seeking_venue, seeking_description, facebook_link
+        FROM "Artist" WHERE deleted_at IS NULL ORDER BY id
+    """,
+    "shows": """
+        SELECT s.show_id, s.venue_id, v.name AS venue_name, s.artist_id,
+            a.name AS artist_name, s.start_time, s.duration, s.image_link
+        FROM "Shows" s
+        JOIN "Venue" v ON v.id = s.venue_id
+        JOIN "Artist" a ON a.id = s.artist_id
+        WHERE v.deleted_at IS NULL AND a.deleted_at IS NULL
+        ORDER BY s.show_id
+    """,
+}
+
+
+def is_ndjson(path):
+    return path.endswith((".ndjson", ".jsonl"))
+
+
+def read_records(stream, ndjson):
+    """
+    Yield one dict per CSV row or NDJSON line of `stream`.
+    """
+    if not ndjson:
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stage_chunk(cursor, columns, records):
+    """
+    COPY a chunk of records into the import_staging temporary table.
+    Empty and missing values are loaded as NULL. Records with a value
+    that does not fit its IMPORT_TYPES type are left out, and so are
+    counted as skipped.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        row = []
+        try:
+            for column in columns:
+                value = record.get(column)
+                if isinstance(value, list):
+                    value = ",".join(value)
+                if value is not None and value != "" and column in IMPORT_TYPES:
+                    value = normalize_import_value(IMPORT_TYPES[column], value)
+                row.append(value)
+        except (ValueError, KeyError, OverflowError):
+            continue
+        writer.writerow(row)
+    buffer.seek(0)
+
+    cursor.copy_expert("COPY import_staging ({}) FROM STDIN WITH (FORMAT csv)"
+                       .format(", ".join(columns)), buffer)
+
+
+def report_progress(kind, done, skipped, started):
+    elapsed = time.perf_counter() - started
+    processed = done + skipped
+    click.echo("{}: {} rows imported, {} skipped, {:.0f} rows/s".format(
+        kind, done, skipped, processed / elapsed if elapsed else 0), err=True)
+
+
+@app.cli.group()
+def data():
+    """Bulk import and export of venues, artists and shows."""
+
+
+@data.command("import")
+@click.argument("kind", type=click.Choice(sorted(IMPORT_COLUMNS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=10000, help="Rows per COPY and commit.")
+def import_data(kind, path, batch_size):
+    """
+    Import venues, artists or shows from a CSV or NDJSON file.
+
+    Shows may reference venues and artists by id (venue_id, artist_id)
+    or by name (venue_name, artist_name).
+    """
+    columns = IMPORT_COLUMNS[kind]
+    done = skipped = 0
+    started = time.perf_counter()
+
+    with open(path, newline="") as stream:
+        for records in chunked(read_records(stream, is_ndjson(path)), batch_size):
+            without_statement_timeout()
+            cursor = db.session.connection().connection.cursor()
+            cursor.execute("CREATE TEMP TABLE import_staging ({}) ON COMMIT DROP"
+                           .format(", ".join(column + " text" for column in columns)))
+            stage_chunk(cursor, columns, records)
+            cursor.execute("ANALYZE import_staging")
+
+            inserted = db.session.execute(db.text(IMPORT_SQL[kind]), {
+                "image_link": DEFAULT_IMAGE_LINK,
+                "duration": DEFAULT_SHOW_DURATION}).rowcount
+            db.session.commit()
+
+            done += inserted
+            skipped += len(records) - inserted
+            report_progress(kind, done, skipped, started)
+
+    cache.invalidate(kind)
+
+
+@data.command("export")
+@click.argument("kind", type=click.Choice(sorted(EXPORT_SQL)))
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--batch-size", default=10000, help="Rows fetched per round trip.")
+def export_data(kind, path, batch_size):
+    """
+    Export venues, artists or shows to a CSV or NDJSON file.
+    """
+    started = time.perf_counter()
+    without_statement_timeout()
+
+    with open(path, "w", newline="") as stream:
+        if not is_ndjson(path):
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)"
+                               .format(EXPORT_SQL[kind]), stream)
+            done = cursor.rowcount
+        else:
+            done = 0
+            result = db.session.connection(
+                execution_options={"stream_results": True}
+            ).execute(db.text(EXPORT_SQL[kind]))
+            for rows in iter(lambda: result.fetchmany(batch_size), []):
+                for row in rows:
+                    record = dict(row)
+                    if "genres" in record:
+                        record["genres"] = record["genres"].split(",")
+                    stream.write(json.dumps(record, default=str) + "\n")
+                done += len(rows)
+                click.echo("{}: {} rows exported".format(kind, done), err=True)
+
+    elapsed = time.perf_counter() - started
+    click.echo("{}: {} rows exported, {:.0f} rows/s".format(
+        kind, done, done / elapsed if elapsed else 0), err=True)
+
+
+#  Index advisor
+#  ----------------------------------------------------------------
+
+# Form posts exercised by the index advisor on top of every GET route.
+ADVISOR_POSTS = [
+    ("/venues/search", {"search_term": "jazz"}),
+    ("/venues/search", {"search_term": "San Francisco, CA"}),
+    ("/artists/search", {"search_term": "rock"}),
+]
+
+
+def advisor_requests():
+    """
+    List (method, url, form) for every GET route, with the busiest venue
+    and artist ids and the busiest artist's first genre filled in for
+    routes that take one, plus ADVISOR_POSTS. /venues/nearby is asked
+    around the busiest venue, or the first known city if it has no
+    coordinates.
+    """
+    samples = {
+        "venue_id": db.session.query(Shows.venue_id).group_by(Shows.venue_id)
+        .order_by(db.func.count().desc()).limit(1).scalar(),
+        "artist_id": db.session.query(Shows.artist_id).group_by(Shows.artist_id)
+        .order_by(db.func.count().desc()).limit(1).scalar(),
+    }
+    samples["genre"] = (db.session.query(Artist.genres)
+                        .filter(Artist.id == samples["artist_id"]).scalar()
+                        or GENRES)[0]
+    location = db.session.query(Venue.latitude, Venue.longitude) \
+        .filter(Venue.id == samples["venue_id"],
+                Venue.latitude.isnot(None)).first()
+    lat, lon = location or geocoder.rows()[0][2:]
+    query_args = {"venues_nearby": {"lat": lat, "lon": lon}}
+
+    requests = []
+    for rule in app.url_map.iter_rules():
+        if "GET" not in rule.methods or rule.endpoint == "static":
+            continue
+        if not rule.arguments.issubset(samples):
+            continue
+        with app.test_request_context():
+            url = url_for(rule.endpoint, **query_args.get(rule.endpoint, {}), **{
+                argument: samples[argument] for argument in rule.arguments})
+        requests.append(("GET", url, None))
+
+    return requests + [("POST", url, form) for url, form in ADVISOR_POSTS]
+
+
+def seq_scans(plan):
+    """
+    Yield (relation, rows read) for every sequential scan in an
+    EXPLAIN (FORMAT JSON) plan tree.
+    """
+    if plan["Node Type"] == "Seq Scan":
+        rows = plan.get("Actual Rows", 0) * plan.get("Actual Loops", 1)
+        rows += plan.get("Rows Removed by Filter", 0)
+        yield plan["Relation Name"], int(rows)
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+# Statements EXPLAIN ANALYZE may run: it executes them, so a CTE
+# writing rows is left out along with every other write.
+DATA_MODIFYING = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def explainable(statement):
+    keyword = statement.split(None, 1)[0].upper() if statement.strip() else ""
+    if keyword == "SELECT":
+        return True
+    return keyword == "WITH" and not DATA_MODIFYING.search(statement)
+
+
+@app.cli.command("advise-indexes")
+@click.option("--min-rows", default=1000,
+              help="Ignore sequential scans reading fewer rows.")
+def advise_indexes(min_rows):
+    """
+    Run every route against the current database, EXPLAIN (ANALYZE, BUFFERS)
+    each SELECT it issues and report the sequential scans.
+    Exits with status 1 if any scan reads at least --min-rows rows.
+
+    The response cache is turned off meanwhile, so every route reaches
+    the database.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if explainable(statement):
+            statements.append((statement, parameters))
+
+    app.config["CACHE_ENABLED"] = False
+    findings = 0
+    for method, url, form in advisor_requests():
+        statements.clear()
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            # Streamed listings query while the body is read.
+            app.test_client().open(url, method=method, data=form).data
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+
+        click.echo("{} {} ({} statements)".format(method, url, len(statements)))
+        for statement, parameters in statements:
+            cursor = db.session.connection().connection.cursor()
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " +
+                           statement, parameters)
+            plan = cursor.fetchone()[0][0]
+            for relation, rows in seq_scans(plan["Plan"]):
+                if rows < min_rows:
+                    continue
+                findings += 1
+                click.echo("  Seq Scan on {} reading {} rows ({:.1f} ms)\n    {}".format(
+                    relation, rows, plan["Execution Time"],
+                    " ".join(statement.split())[:200]))
+        db.session.rollback()
+
+    click.echo("{} sequential scans over {} rows".format(findings, min_rows))
+    if findings:
+        sys.exit(1)
+
+
+#  Upcoming show counters
+#  ----------------------------------------------------------------
+
+COUNTER_TABLES = [("Venue", "venue_id"), ("Artist", "artist_id")]
+
+# Shows count only while both their venue and artist are live; the
+# triggers on Shows follow the same rule.
+LIVE_SHOWS = """
+    "Shows" s
+    JOIN "Venue" sv ON sv.id = s.venue_id AND sv.deleted_at IS NULL
+    JOIN "Artist" sa ON sa.id = s.artist_id AND sa.deleted_at IS NULL
+"""
+
+# Subtract the shows that started between two watermarks.
+SWEEP_SQL = """
+    UPDATE "{table}" t SET upcoming_shows_count = upcoming_shows_count - d.n
+    FROM (SELECT s.{column}, count(*) AS n FROM """ + LIVE_SHOWS + """
+          WHERE s.start_time > :since AND s.start_time <= :until
+          GROUP BY s.{column}) d
+    WHERE t.id = d.{column}
+"""
+
+# Rows whose stored counter differs from a recount against the watermark.
+DRIFT_SQL = """
+    SELECT t.id, t.upcoming_shows_count AS stored, count(s.show_id) AS actual
+    FROM "{table}" t
+    LEFT JOIN (""" + LIVE_SHOWS + """)
+        ON s.{column} = t.id AND s.start_time > :watermark
+    GROUP BY t.id
+    HAVING t.upcoming_shows_count <> count(s.show_id)
+    ORDER BY t.id
+"""
+
+
+def lock_watermark():
+    """
+    Lock the counter watermark for the rest of the transaction. Show
+    writes hold a share lock on it, so this waits for in-flight writes
+    and holds new ones back until commit.
+    """
+    return ShowCounterSweep.query.with_for_update().one()
+
+
+# Take the upcoming shows of a venue or artist being deleted off the
+# counters of its live counterparts.
+UNCOUNT_SQL = """
+    UPDATE "{other}" t SET upcoming_shows_count = upcoming_shows_count - d.n
+    FROM (SELECT {other_column}, count(*) AS n FROM "Shows"
+          WHERE {column} = :id AND start_time > :watermark
+          GROUP BY {other_column}) d
+    WHERE t.id = d.{other_column} AND t.deleted_at IS NULL
+"""
+
+
+def soft_delete(model, entity_id):
+    """
+    Stamp deleted_at on a live venue or artist and take its upcoming shows
+    off the counters in the same transaction, so listings agree with the
+    detail pages before `flask purge-deleted` runs. Holds the watermark
+    lock until commit, so no show write or sweep runs in between.
+    Returns whether a row was deleted.
+    """
+    watermark = lock_watermark().swept_at
+    deleted = model.query.filter(model.id == entity_id,
+                                 model.deleted_at.is_(None)) \
+        .update({"deleted_at": datetime.now(), "upcoming_shows_count": 0},
+                synchronize_session=False)
+    if deleted:
+        column, other, other_column = \
+            ("venue_id", "Artist", "artist_id") if model is Venue \
+            else ("artist_id", "Venue", "venue_id")
+        db.session.execute(db.text(UNCOUNT_SQL.format(
+            other=other, column=column, other_column=other_column)),
+            {"id": entity_id, "watermark": watermark})
+    return bool(deleted)
+
+
+def sweep_counters_once():
+    """
+    Advance the watermark to now and take the shows that started since
+    the previous sweep off the counters. Returns the number of rows updated.
+    """
+    sweep = lock_watermark()
+    until = datetime.now()
+    updated = 0
+    if until > sweep.swept_at:
+        for table, column in COUNTER_TABLES:
+            updated += db.session.execute(
+                db.text(SWEEP_SQL.format(table=table, column=column)),
+                {"since": sweep.swept_at, "until": until}).rowcount
+        sweep.swept_at = until
+    db.session.commit()
+    if updated:
+        cache.invalidate('venues', 'artists')
+    return updated
+
+
+@app.cli.command("sweep-counters")
+@click.option("--every", default=0,
+              help="Keep sweeping every N seconds instead of once.")
+def sweep_counters(every):
+    """
+    Move the upcoming show counters past the shows that have started.
+    Run it from cron, or with --every as a long-lived worker; counters lag
+    real time by at most the interval between sweeps.
+    """
+    while True:
+        updated = sweep_counters_once()
+        click.echo("Swept counters up to {}, {} rows updated".format(
+            ShowCounterSweep.query.one().swept_at, updated))
+        if not every:
+            break
+        time.sleep(every)
+
+
+@app.cli.command("check-counters")
+@click.option("--fix", is_flag=True, help="Rewrite the counters that drifted.")
+def check_counters(fix):
+    """
+    Recount upcoming shows and report counters that disagree.
+    Exits with status 1 if drift is found and not fixed.
+    """
+    without_statement_timeout()
+    watermark = lock_watermark().swept_at
+    drifted = 0
+    for table, column in COUNTER_TABLES:
+        rows = db.session.execute(
+            db.text(DRIFT_SQL.format(table=table, column=column)),
+            {"watermark": watermark}).fetchall()
+        for row in rows:
+            click.echo("{} {}: stored {}, actual {}".format(
+                table, row.id, row.stored, row.actual))
+        if fix:
+            for row in rows:
+                db.session.execute(
+                    db.text('UPDATE "{}" SET upcoming_shows_count = :actual '
+                            'WHERE id = :id'.format(table)),
+                    {"id": row.id, "actual": row.actual})
+        drifted += len(rows)
+    db.session.commit()
+
+    click.echo("{} counters drifted{}".format(drifted, ", fixed" if fix and drifted else ""))
+    if drifted and not fix:
+        sys.exit(1)
+    if drifted:
+        cache.invalidate('venues', 'artists')
+
+
+#  Purge soft deleted rows
+#  ----------------------------------------------------------------
+
+# Delete one batch of the shows of a deleted venue or artist.
+PURGE_SHOWS_SQL = """
+    DELETE FROM "Shows" WHERE show_id IN (
+        SELECT show_id FROM "Shows" WHERE {column} = :id LIMIT :batch_size)
+"""
+
+
+def purge_deleted_once(batch_size, pause=0):
+    """
+    Remove every soft deleted venue and artist along with their shows.
+    Shows go in batches of `batch_size`, each in its own short
+    transaction, so no statement holds locks on many rows for long.
+    Returns the number of (rows, shows) removed.
+    """
+    rows = shows = 0
+    for model, column in ((Venue, "venue_id"), (Artist, "artist_id")):
+        pending = [entity_id for entity_id, in db.session.query(model.id)
+                   .filter(model.deleted_at.isnot(None))
+                   .order_by(model.deleted_at)]
+        db.session.commit()
+
+        for entity_id in pending:
+            while True:
+                deleted = db.session.execute(
+                    db.text(PURGE_SHOWS_SQL.format(column=column)),
+                    {"id": entity_id, "batch_size": batch_size}).rowcount
+                db.session.commit()
+                shows += deleted
+                if deleted < batch_size:
+                    break
+                time.sleep(pause)
+
+            try:
+                rows += model.query.filter(
+                    model.id == entity_id, model.deleted_at.isnot(None)) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
+            except IntegrityError:
+                # A show was booked in between; the next run retries.
+                db.session.rollback()
+    return rows, shows
+
+
+@app.cli.command("purge-deleted")
+@click.option("--batch-size", default=1000,
+              help="Shows deleted per transaction.")
+@click.option("--pause", default=0.0,
+              help="Seconds to sleep between batches.")
+@click.option("--every", default=0,
+              help="Keep purging every N seconds instead of once.")
+def purge_deleted(batch_size, pause, every):
+    """
+    Permanently remove soft deleted venues and artists and their shows.
+    """
+    while True:
+        rows, shows = purge_deleted_once(batch_size, pause)
+        click.echo("Purged {} venues/artists and {} shows".format(rows, shows))
+        if not every:
+            break
+        time.sleep(every)
+
+
+#  Geocoding
+#  ----------------------------------------------------------------
+
+GEOCODE_SQL = """
+    UPDATE "Venue" v SET latitude = c.latitude, longitude = c.longitude
+    FROM city_centroids c
+    WHERE lower(regexp_replace(btrim(v.city), '\\s+', ' ', 'g')) = c.city
+        AND upper(v.state) = c.state
+        {only_missing}
+"""
+
+
+def geocode_venues(overwrite=False):
+    """
+    Set the coordinates of venues from the bundled city centroids, in one
+    statement whatever the number of venues. Only venues without
+    coordinates are updated unless `overwrite` is set. Returns the number
+    of venues updated.
+    """
+    without_statement_timeout()
+    db.session.execute("CREATE TEMP TABLE city_centroids (city text, state text, "
+                       "latitude float8, longitude float8) ON COMMIT DROP")
+    db.session.execute(db.text(
+        "INSERT INTO city_centroids VALUES (:city, :state, :latitude, :longitude)"),
+        [{"city": city, "state": state, "latitude": latitude, "longitude": longitude}
+         for city, state, latitude, longitude in geocoder.rows()])
+    return db.session.execute(GEOCODE_SQL.format(
+        only_missing="" if overwrite else "AND v.latitude IS NULL")).rowcount
+
+
+@app.cli.command("geocode-venues")
+@click.option("--all", "overwrite", is_flag=True,
+              help="Geocode every venue again, not only those without coordinates.")
+def geocode_venues_command(overwrite):
+    """
+    Place venues at the centroid of their city, e.g. after an import.
+    """
+    updated = geocode_venues(overwrite)
+    db.session.commit()
+    missing = Venue.query.filter(Venue.latitude.is_(None),
+                                 Venue.deleted_at.is_(None)).count()
+    click.echo("Geocoded {} venues, {} in unknown cities".format(updated, missing))
+
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -0,0 +1,83 @@
+"""
+Shows page rendering benchmark.
+
+Renders pages/shows.html with synthetic rows using the previous
+string-parsing datetime filter and the cached one. No database needed.
+
+Usage, from the Project01-Fyyur directory:
+
+    python benchmarks/render_shows.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template  # noqa: E402
+from app import app, format_datetime  # noqa: E402
+
+
+def legacy_format_datetime(value, format='medium'):
+    # The filter as it was before patterns and results were cached.
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def make_shows(rows, as_string):
+    # Shows fall on a few hundred distinct times, as a real calendar does.
+    start = datetime(2030, 1, 1, 20)
+    shows = []
+    for i in range(rows):
+        start_time = start + timedelta(days=i % 365, hours=i % 3)
+        shows.append({
+            "venue_id": i % 100,
+            "venue_name": "Venue {}".format(i % 100),
+            "artist_id": i,
+            "artist_name": "Artist {}".format(i),
+            "artist_image_link": "https://example.com/{}.jpg".format(i),
+            "start_time": str(start_time) if as_string else start_time,
+        })
+    return shows
+
+
+def time_render(shows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_template('pages/shows.html', shows=shows, next_page=None)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.test_request_context('/shows'):
+        app.jinja_env.filters['datetime'] = legacy_format_datetime
+        legacy = time_render(make_shows(args.rows, True), args.repeat)
+
+        app.jinja_env.filters['datetime'] = format_datetime
+        format_datetime.cache_clear()
+        cached = time_render(make_shows(args.rows, False), args.repeat)
+
+    print("legacy filter, string times  {:>9.1f} ms".format(legacy))
+    print("cached filter, datetimes     {:>9.1f} ms".format(cached))
+    print(format_datetime.cache_info())
+
+
+if __name__ == "__main__":
+    main()
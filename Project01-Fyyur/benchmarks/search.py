@@ -0,0 +1,98 @@
+"""
+Search latency benchmark.
+
+Times the venue and artist search queries with and without the search
+indexes (they are dropped inside a transaction that is rolled back).
+
+Usage, from the Project01-Fyyur directory:
+
+    python benchmarks/search.py --seed --artists 1000000
+    python benchmarks/search.py --runs 500
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Venue, Artist, search_query, seed  # noqa: E402
+
+SEARCH_INDEXES = [
+    "ix_venue_name_trgm", "ix_venue_city_trgm", "ix_venue_genres",
+    "ix_venue_state_city", "ix_artist_name_trgm", "ix_artist_city_trgm",
+    "ix_artist_genres", "ix_artist_state_city",
+]
+
+# Fragments of the md5 based names generated by `flask seed`,
+# plus city, state and genre terms.
+TERMS = [hashlib.md5(str(i).encode()).hexdigest()[2:6]
+         for i in range(1, 20)] + [
+    "jazz", "Hip-Hop", "austin", "TX", "San Francisco, CA", "nothing-matches",
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = int(round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def time_searches(connection, model, runs):
+    """
+    Run `runs` searches against `model` and return their latencies in ms.
+    """
+    samples = []
+    for i in range(runs):
+        statement = search_query(model, TERMS[i % len(TERMS)], 1,
+                                 app.config["SEARCH_RESULTS_PER_PAGE"]).statement
+        start = time.perf_counter()
+        connection.execute(statement).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    print("{:<28} p50 {:>9.2f} ms   p99 {:>9.2f} ms".format(
+        label, percentile(samples, 50), percentile(samples, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seed", action="store_true",
+                        help="seed the database before benchmarking")
+    parser.add_argument("--artists", type=int, default=1000000)
+    parser.add_argument("--venues", type=int, default=100000)
+    parser.add_argument("--shows", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.seed:
+            result = app.test_cli_runner().invoke(seed, [
+                "--artists", args.artists, "--venues", args.venues,
+                "--shows", args.shows])
+            print(result.output, end="")
+            db.session.execute("ANALYZE")
+            db.session.commit()
+
+        targets = [("venues", Venue), ("artists", Artist)]
+
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            for index in SEARCH_INDEXES:
+                connection.execute('DROP INDEX IF EXISTS "{}"'.format(index))
+            for name, model in targets:
+                report("search {} (no index)".format(name),
+                       time_searches(connection, model, args.runs))
+            transaction.rollback()
+
+        with db.engine.connect() as connection:
+            for name, model in targets:
+                report("search {} (indexed)".format(name),
+                       time_searches(connection, model, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class LRUBackend:
+    """
+    In-process store keeping the most recently used responses.
+    Tag versions are kept apart so they are never evicted.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (time.time() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_versions(self, tags):
+        with self.lock:
+            return [self.versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+class RedisBackend:
+    """
+    Store shared by every worker through a Redis compatible server, so an
+    invalidation in one worker is seen by all of them.
+    """
+
+    def __init__(self, url, prefix="fyyur:cache:"):
+        if redis is None:
+            raise RuntimeError("CACHE_TYPE 'redis' requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=timeout)
+
+    def get_versions(self, tags):
+        versions = self.client.mget([self.prefix + "tag:" + tag for tag in tags])
+        return [int(version or 0) for version in versions]
+
+    def bump(self, tags):
+        pipeline = self.client.pipeline()
+        for tag in tags:
+            pipeline.incr(self.prefix + "tag:" + tag)
+        pipeline.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class ResponseCache:
+    """
+    Cache rendered GET responses keyed by path, query string, negotiated
+    representation (HTML or JSON) and the versions of the tags a view
+    depends on. Writes call invalidate() with
+    the tags they change, which bumps the versions and makes every
+    dependent entry unreachable.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CACHE_ENABLED", True)
+        app.config.setdefault("CACHE_TYPE", "lru")
+        app.config.setdefault("CACHE_MAX_ENTRIES", 1024)
+        app.config.setdefault("CACHE_TIMEOUT", 300)
+        app.config.setdefault("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+        if app.config["CACHE_TYPE"] == "redis":
+            self.backend = RedisBackend(app.config["CACHE_REDIS_URL"])
+        else:
+            self.backend = LRUBackend(app.config["CACHE_MAX_ENTRIES"])
+
+    def make_key(self, tags):
+        versions = self.backend.get_versions(tags)
+        args = sorted(request.args.items(multi=True))
+        accept = request.accept_mimetypes.best_match(["text/html", "application/json"])
+        raw = "{}|{}|{}|{}".format(request.path, args, accept, versions)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def cached(self, *tags):
+        """
+        Decorate a view so its 200 responses are served from the cache
+        until one of `tags` is invalidated or CACHE_TIMEOUT passes.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Pending flash messages are rendered into the page,
+                # so those responses must be neither cached nor served
+                # from the cache.
+                if not current_app.config["CACHE_ENABLED"] or \
+                        request.method != "GET" or "_flashes" in session:
+                    return view(*args, **kwargs)
+
+                key = self.make_key(tags)
+                entry = self.backend.get(key)
+
+                if entry is not None:
+                    body, mimetype, etag, last_modified = entry
+                    response = current_app.response_class(body, mimetype=mimetype)
+                    response.set_etag(etag)
+                    response.last_modified = last_modified
+                    response.headers["X-Cache"] = "HIT"
+                    response.vary.add("Accept")
+                    return response.make_conditional(request)
+
+                response = make_response(view(*args, **kwargs))
+                response.vary.add("Accept")
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+
+                body = response.get_data()
+                etag = hashlib.md5(body).hexdigest()
+                last_modified = int(time.time())
+                self.backend.set(key, (body, response.mimetype, etag, last_modified),
+                                 current_app.config["CACHE_TIMEOUT"])
+
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.headers["X-Cache"] = "MISS"
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags):
+        self.backend.bump(tags)
+
+    def clear(self):
+        self.backend.clear()
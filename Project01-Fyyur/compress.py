@@ -0,0 +1,72 @@
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Compress:
+    """
+    Compress responses larger than COMPRESS_MIN_SIZE with brotli, when
+    the package is installed and the client accepts it, or gzip.
+    Streamed and already encoded responses are left alone.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_ENABLED", True)
+        app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+        app.config.setdefault("COMPRESS_LEVEL", 6)
+        app.config.setdefault("COMPRESS_MIMETYPES", [
+            "text/html", "text/css", "text/plain", "application/json",
+            "application/javascript"])
+        self.app = app
+        app.after_request(self.compress)
+
+    def choose_encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def compress(self, response):
+        config = self.app.config
+        if not config["COMPRESS_ENABLED"] or \
+                response.mimetype not in config["COMPRESS_MIMETYPES"]:
+            return response
+        response.vary.add("Accept-Encoding")
+
+        if response.is_streamed or response.direct_passthrough or \
+                "Content-Encoding" in response.headers or \
+                not 200 <= response.status_code < 300 or \
+                response.content_length is None or \
+                response.content_length < config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        body = response.get_data()
+        if encoding == "br":
+            body = brotli.compress(body, quality=config["COMPRESS_LEVEL"])
+        else:
+            body = gzip.compress(body, compresslevel=config["COMPRESS_LEVEL"])
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+
+        # The compressed body is another representation of the same
+        # resource, so a strong validator no longer applies.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
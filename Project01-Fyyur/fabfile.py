@@ -6,13 +6,23 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local("python test_app.py -v", capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def benchmark(baseline="benchmarks/baseline.json"):
+    # Needs a seeded database, see benchmarks/load.py. The first run
+    # records the baseline, later runs fail on regressions against it.
+    import os
+    option = "--baseline" if os.path.exists(baseline) else "--save"
+    with settings(warn_only=True):
+        result = local("python benchmarks/load.py --no-cache {} {}".format(
+            option, baseline))
+    if result.failed and not confirm("Performance regressed. Continue?"):
+        abort("Aborted at user request.")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -39,9 +49,7 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run python test_app.py -v")
 
 
 def deploy():
@@ -1,7 +1,78 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField, HiddenField
+from wtforms.validators import DataRequired, URL, ValidationError
+
+STATES = (
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID',
+    'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM',
+    'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'PA',
+    'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+)
+
+GENRES = (
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+    'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre',
+    'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+)
+
+# Choices are built once at import and shared by every form instance,
+# and submitted values are checked against frozensets instead of scanning
+# the choices. The create and edit handlers read request.form directly
+# and never validate the forms, so clean_state() and clean_genres() do
+# the checking there; the OneOf validators only run on form.validate().
+STATE_CHOICES = [(state, state) for state in STATES]
+GENRE_CHOICES = [(genre, genre) for genre in GENRES]
+VALID_STATES = frozenset(STATES)
+VALID_GENRES = frozenset(GENRES)
+
+# Canonical spelling of each genre by its lower case name.
+GENRE_LOOKUP = {genre.lower(): genre for genre in GENRES}
+
+
+def lookup_genre(value):
+    """
+    Return the canonical spelling of a genre, matched case-insensitively,
+    or None if it is not a known genre.
+    """
+    return GENRE_LOOKUP.get(value.strip().lower())
+
+
+def clean_state(value):
+    """
+    Upper-case a submitted state, raising ValueError if it is unknown.
+    """
+    state = value.strip().upper()
+    if state not in VALID_STATES:
+        raise ValueError("Unknown state {!r}".format(value))
+    return state
+
+
+def clean_genres(values):
+    """
+    Map submitted genres to their canonical spelling, raising ValueError
+    if any of them is unknown.
+    """
+    genres = [lookup_genre(value) for value in values]
+    if None in genres:
+        raise ValueError("Unknown genre in {!r}".format(values))
+    return genres
+
+
+class OneOf:
+    """
+    Validate that a field's data, or every item of a multiple select,
+    is in `values`, a frozenset.
+    """
+
+    def __init__(self, values, message=None):
+        self.values = values
+        self.message = message or 'Not a valid choice'
+
+    def __call__(self, form, field):
+        data = field.data if isinstance(field.data, list) else [field.data]
+        if not self.values.issuperset(data):
+            raise ValidationError(self.message)
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -15,6 +86,10 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        default=120
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -24,60 +99,9 @@ class VenueForm(Form):
         'city', validators=[DataRequired()]
     )
     state = SelectField(
-        'state', validators=[DataRequired()],
-        choices=[
-            ('AL', 'AL'),
-            ('AK', 'AK'),
-            ('AZ', 'AZ'),
-            ('AR', 'AR'),
-            ('CA', 'CA'),
-            ('CO', 'CO'),
-            ('CT', 'CT'),
-            ('DE', 'DE'),
-            ('DC', 'DC'),
-            ('FL', 'FL'),
-            ('GA', 'GA'),
-            ('HI', 'HI'),
-            ('ID', 'ID'),
-            ('IL', 'IL'),
-            ('IN', 'IN'),
-            ('IA', 'IA'),
-            ('KS', 'KS'),
-            ('KY', 'KY'),
-            ('LA', 'LA'),
-            ('ME', 'ME'),
-            ('MT', 'MT'),
-            ('NE', 'NE'),
-            ('NV', 'NV'),
-            ('NH', 'NH'),
-            ('NJ', 'NJ'),
-            ('NM', 'NM'),
-            ('NY', 'NY'),
-            ('NC', 'NC'),
-            ('ND', 'ND'),
-            ('OH', 'OH'),
-            ('OK', 'OK'),
-            ('OR', 'OR'),
-            ('MD', 'MD'),
-            ('MA', 'MA'),
-            ('MI', 'MI'),
-            ('MN', 'MN'),
-            ('MS', 'MS'),
-            ('MO', 'MO'),
-            ('PA', 'PA'),
-            ('RI', 'RI'),
-            ('SC', 'SC'),
-            ('SD', 'SD'),
-            ('TN', 'TN'),
-            ('TX', 'TX'),
-            ('UT', 'UT'),
-            ('VT', 'VT'),
-            ('VA', 'VA'),
-            ('WA', 'WA'),
-            ('WV', 'WV'),
-            ('WI', 'WI'),
-            ('WY', 'WY'),
-        ]
+        'state',
+        choices=STATE_CHOICES, validate_choice=False,
+        validators=[DataRequired(), OneOf(VALID_STATES)]
     )
     address = StringField(
         'address', validators=[DataRequired()]
@@ -89,28 +113,9 @@ class VenueForm(Form):
         'image_link'
     )
     genres = SelectMultipleField(
-        'genres', validators=[DataRequired()],
-        choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+        'genres',
+        choices=GENRE_CHOICES, validate_choice=False,
+        validators=[DataRequired(), OneOf(VALID_GENRES)]
     )
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
@@ -124,6 +129,10 @@ class VenueForm(Form):
     seeking_description = StringField(
         'seeking_description'
     )
+    # Version of the row the edit form was rendered from.
+    version = HiddenField(
+        'version'
+    )
 
 class ArtistForm(Form):
     name = StringField(
@@ -133,60 +142,9 @@ class ArtistForm(Form):
         'city', validators=[DataRequired()]
     )
     state = SelectField(
-        'state', validators=[DataRequired()],
-        choices=[
-            ('AL', 'AL'),
-            ('AK', 'AK'),
-            ('AZ', 'AZ'),
-            ('AR', 'AR'),
-            ('CA', 'CA'),
-            ('CO', 'CO'),
-            ('CT', 'CT'),
-            ('DE', 'DE'),
-            ('DC', 'DC'),
-            ('FL', 'FL'),
-            ('GA', 'GA'),
-            ('HI', 'HI'),
-            ('ID', 'ID'),
-            ('IL', 'IL'),
-            ('IN', 'IN'),
-            ('IA', 'IA'),
-            ('KS', 'KS'),
-            ('KY', 'KY'),
-            ('LA', 'LA'),
-            ('ME', 'ME'),
-            ('MT', 'MT'),
-            ('NE', 'NE'),
-            ('NV', 'NV'),
-            ('NH', 'NH'),
-            ('NJ', 'NJ'),
-            ('NM', 'NM'),
-            ('NY', 'NY'),
-            ('NC', 'NC'),
-            ('ND', 'ND'),
-            ('OH', 'OH'),
-            ('OK', 'OK'),
-            ('OR', 'OR'),
-            ('MD', 'MD'),
-            ('MA', 'MA'),
-            ('MI', 'MI'),
-            ('MN', 'MN'),
-            ('MS', 'MS'),
-            ('MO', 'MO'),
-            ('PA', 'PA'),
-            ('RI', 'RI'),
-            ('SC', 'SC'),
-            ('SD', 'SD'),
-            ('TN', 'TN'),
-            ('TX', 'TX'),
-            ('UT', 'UT'),
-            ('VT', 'VT'),
-            ('VA', 'VA'),
-            ('WA', 'WA'),
-            ('WV', 'WV'),
-            ('WI', 'WI'),
-            ('WY', 'WY'),
-        ]
+        'state',
+        choices=STATE_CHOICES, validate_choice=False,
+        validators=[DataRequired(), OneOf(VALID_STATES)]
     )
     phone = StringField(
         'phone'
@@ -195,28 +153,9 @@ class ArtistForm(Form):
         'image_link'
     )
     genres = SelectMultipleField(
-        'genres', validators=[DataRequired()],
-        choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+        'genres',
+        choices=GENRE_CHOICES, validate_choice=False,
+        validators=[DataRequired(), OneOf(VALID_GENRES)]
     )
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
@@ -230,4 +169,8 @@ class ArtistForm(Form):
     seeking_description = StringField(
         'seeking_description'
     )
+    # Version of the row the edit form was rendered from.
+    version = HiddenField(
+        'version'
+    )
 
@@ -0,0 +1,54 @@
+import csv
+import os
+import threading
+
+DEFAULT_CENTROIDS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "city_centroids.csv")
+
+
+def normalize_city(city):
+    return " ".join(city.split()).lower()
+
+
+class CentroidGeocoder:
+    """
+    Offline geocoder placing an address at the centroid of its city, read
+    from the CITY_CENTROIDS_FILE CSV (city, state, latitude, longitude).
+    The file is loaded on first use. The bundled file only covers the
+    larger US cities; addresses elsewhere are not located.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.centroids = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CITY_CENTROIDS_FILE", DEFAULT_CENTROIDS_FILE)
+        self.app = app
+
+    def load(self):
+        with self.lock:
+            if self.centroids is None:
+                with open(self.app.config["CITY_CENTROIDS_FILE"], newline="") as stream:
+                    self.centroids = {
+                        (normalize_city(row["city"]), row["state"].upper()):
+                            (float(row["latitude"]), float(row["longitude"]))
+                        for row in csv.DictReader(stream)}
+        return self.centroids
+
+    def rows(self):
+        """
+        Every centroid as (city, state, latitude, longitude), with the
+        city normalized as by locate().
+        """
+        return [(city, state, latitude, longitude)
+                for (city, state), (latitude, longitude) in self.load().items()]
+
+    def locate(self, city, state):
+        """
+        Return (latitude, longitude) of a city, or None if it is unknown.
+        """
+        return self.load().get((normalize_city(city), state.upper()))
@@ -0,0 +1,135 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds, in seconds, of the pool wait time histogram buckets.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense: each bucket counts the
+    observations less than or equal to its upper bound.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class PoolMetrics:
+    """
+    Telemetry of the connection pool of one process: checkouts, time spent
+    waiting for a connection, overflow connections opened, checkout
+    timeouts and invalidated connections.
+    """
+
+    def __init__(self):
+        self.wait = Histogram(WAIT_BUCKETS)
+        self.checkouts = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def increment(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def pool_class(self, base=QueuePool):
+        """
+        Return a subclass of `base` reporting to these metrics. Pass it
+        as the `poolclass` engine option; pools recreated after an
+        invalidation keep reporting since they share the class.
+        """
+        metrics = self
+
+        class InstrumentedPool(base):
+
+            def _do_get(self):
+                start = time.perf_counter()
+                overflow = self.overflow()
+                try:
+                    connection = super()._do_get()
+                except exc.TimeoutError:
+                    metrics.increment("timeouts")
+                    raise
+                finally:
+                    metrics.wait.observe(time.perf_counter() - start)
+                if self.overflow() > max(overflow, 0):
+                    metrics.increment("overflows")
+                return connection
+
+        event.listen(InstrumentedPool, "checkout",
+                     lambda *args: metrics.increment("checkouts"))
+        event.listen(InstrumentedPool, "invalidate",
+                     lambda *args: metrics.increment("invalidations"))
+        event.listen(InstrumentedPool, "soft_invalidate",
+                     lambda *args: metrics.increment("invalidations"))
+        return InstrumentedPool
+
+    def snapshot(self, pool):
+        """
+        Current state of `pool` and the counters as a JSON-able dict.
+        """
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "checkouts": self.checkouts,
+            "overflows": self.overflows,
+            "timeouts": self.timeouts,
+            "invalidations": self.invalidations,
+            "wait_seconds": {
+                "count": self.wait.count,
+                "sum": round(self.wait.sum, 6),
+                "buckets": dict(zip((str(b) for b in self.wait.buckets),
+                                    self.wait.counts)),
+            },
+        }
+
+    def render(self, pool, prefix="fyyur_db_pool"):
+        """
+        Render the snapshot of `pool` in the Prometheus text format.
+        """
+        stats = self.snapshot(pool)
+        lines = []
+
+        def metric(name, kind, help, value):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            lines.append("{}_{} {}".format(prefix, name, value))
+
+        metric("size", "gauge", "Connections kept open by the pool.", stats["size"])
+        metric("checked_in", "gauge", "Idle connections in the pool.", stats["checked_in"])
+        metric("checked_out", "gauge", "Connections in use.", stats["checked_out"])
+        metric("overflow", "gauge", "Open connections beyond the pool size.", stats["overflow"])
+        metric("checkouts_total", "counter", "Connections handed out.", stats["checkouts"])
+        metric("overflows_total", "counter", "Overflow connections opened.", stats["overflows"])
+        metric("timeouts_total", "counter", "Checkouts that timed out.", stats["timeouts"])
+        metric("invalidations_total", "counter", "Connections invalidated.", stats["invalidations"])
+
+        name = prefix + "_wait_seconds"
+        lines.append("# HELP {} Time spent waiting for a connection.".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for bound, count in zip(self.wait.buckets, self.wait.counts):
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, count))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, self.wait.count))
+        lines.append("{}_sum {}".format(name, self.wait.sum))
+        lines.append("{}_count {}".format(name, self.wait.count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+"""search indexes for venues and artists
+
+Revision ID: 3f9a2c7d1e84
+Revises: 5968d8cd4dc7
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c7d1e84'
+down_revision = '5968d8cd4dc7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The model declares Artist.genres as ARRAY(String) but earlier
+    # revisions left it as VARCHAR; align it so it can be GIN indexed.
+    columns = sa.inspect(op.get_bind()).get_columns('Artist')
+    genres = next(column for column in columns if column['name'] == 'genres')
+    if not isinstance(genres['type'], sa.ARRAY):
+        op.alter_column('Artist', 'genres',
+                        existing_type=sa.VARCHAR(length=120),
+                        type_=sa.ARRAY(sa.String()),
+                        postgresql_using="CASE WHEN left(genres, 1) = '{' "
+                        "THEN genres::varchar[] "
+                        "ELSE string_to_array(genres, ',') END")
+
+    # Trigram indexes serve the ILIKE '%term%' searches on name and city,
+    # GIN array indexes serve genre matches (genres && ARRAY[...]) and
+    # (state, city) serves exact state and "City, ST" matches.
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('Venue', 'Artist'):
+        prefix = 'ix_' + table.lower()
+        op.create_index(prefix + '_name_trgm', table, ['name'],
+                        postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index(prefix + '_city_trgm', table, ['city'],
+                        postgresql_using='gin',
+                        postgresql_ops={'city': 'gin_trgm_ops'})
+        op.create_index(prefix + '_genres', table, ['genres'],
+                        postgresql_using='gin')
+        op.create_index(prefix + '_state_city', table, ['state', 'city'])
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        prefix = 'ix_' + table.lower()
+        op.drop_index(prefix + '_state_city', table_name=table)
+        op.drop_index(prefix + '_genres', table_name=table)
+        op.drop_index(prefix + '_city_trgm', table_name=table)
+        op.drop_index(prefix + '_name_trgm', table_name=table)
@@ -0,0 +1,125 @@
+"""upcoming show counters leave out deleted venues and artists
+
+Revision ID: 6d2f0b8e3a17
+Revises: f3b9e6a1c824
+Create Date: 2026-10-18 21:12:06.418793
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f0b8e3a17'
+down_revision = 'f3b9e6a1c824'
+branch_labels = None
+depends_on = None
+
+
+# Shows count only while both their venue and artist are live. Deleting a
+# venue or artist takes its shows off the counters at once (see
+# soft_delete() in app.py), so the triggers must not take them off again
+# when `flask purge-deleted` removes those shows.
+COUNTED_SHOWS = """
+    SELECT s.{column}, count(*) AS n FROM {rows} s
+    JOIN "Venue" sv ON sv.id = s.venue_id AND sv.deleted_at IS NULL
+    JOIN "Artist" sa ON sa.id = s.artist_id AND sa.deleted_at IS NULL
+    WHERE s.start_time > watermark GROUP BY s.{column}
+"""
+
+COUNTER_UPDATE = """
+        UPDATE "{table}" t SET upcoming_shows_count = upcoming_shows_count {sign} d.n
+        FROM ({counted}) d
+        WHERE t.id = d.{column};
+"""
+
+
+def counter_updates(rows, sign):
+    return "".join(
+        COUNTER_UPDATE.format(table=table, column=column, sign=sign,
+                              counted=COUNTED_SHOWS.format(column=column, rows=rows))
+        for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')))
+
+
+COUNTER_FUNCTION = """
+CREATE OR REPLACE FUNCTION shows_upcoming_counter() RETURNS trigger AS $$
+DECLARE
+    watermark timestamp;
+BEGIN
+    SELECT swept_at INTO watermark FROM show_counter_sweep FOR SHARE;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+{old}
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+{new}
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# The function as created by e2a8b7c90f15, counting every show.
+PREVIOUS_COUNTER_FUNCTION = """
+CREATE OR REPLACE FUNCTION shows_upcoming_counter() RETURNS trigger AS $$
+DECLARE
+    watermark timestamp;
+BEGIN
+    SELECT swept_at INTO watermark FROM show_counter_sweep FOR SHARE;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE "Venue" v SET upcoming_shows_count = upcoming_shows_count - d.n
+        FROM (SELECT venue_id, count(*) AS n FROM old_rows
+              WHERE start_time > watermark GROUP BY venue_id) d
+        WHERE v.id = d.venue_id;
+        UPDATE "Artist" a SET upcoming_shows_count = upcoming_shows_count - d.n
+        FROM (SELECT artist_id, count(*) AS n FROM old_rows
+              WHERE start_time > watermark GROUP BY artist_id) d
+        WHERE a.id = d.artist_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE "Venue" v SET upcoming_shows_count = upcoming_shows_count + d.n
+        FROM (SELECT venue_id, count(*) AS n FROM new_rows
+              WHERE start_time > watermark GROUP BY venue_id) d
+        WHERE v.id = d.venue_id;
+        UPDATE "Artist" a SET upcoming_shows_count = upcoming_shows_count + d.n
+        FROM (SELECT artist_id, count(*) AS n FROM new_rows
+              WHERE start_time > watermark GROUP BY artist_id) d
+        WHERE a.id = d.artist_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# Recount every counter under the new rule.
+RECOUNT = """
+    UPDATE "{table}" t SET upcoming_shows_count = coalesce(d.n, 0)
+    FROM "{table}" r LEFT JOIN ({counted}) d ON d.{column} = r.id
+    WHERE t.id = r.id AND t.upcoming_shows_count <> coalesce(d.n, 0)
+"""
+
+
+def recount(counted):
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.execute(RECOUNT.format(
+            table=table, column=column,
+            counted=counted.format(column=column, rows='"Shows"').replace(
+                'watermark', '(SELECT swept_at FROM show_counter_sweep)')))
+
+
+def upgrade():
+    op.execute(COUNTER_FUNCTION.format(old=counter_updates('old_rows', '-'),
+                                       new=counter_updates('new_rows', '+')))
+    recount(COUNTED_SHOWS)
+
+
+def downgrade():
+    op.execute(PREVIOUS_COUNTER_FUNCTION)
+    recount("""
+        SELECT {column}, count(*) AS n FROM {rows}
+        WHERE start_time > watermark GROUP BY {column}
+    """)
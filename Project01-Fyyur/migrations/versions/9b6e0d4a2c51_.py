@@ -0,0 +1,25 @@
+"""keyset index for the shows feed
+
+Revision ID: 9b6e0d4a2c51
+Revises: 3f9a2c7d1e84
+Create Date: 2026-10-18 11:03:47.218390
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9b6e0d4a2c51'
+down_revision = '3f9a2c7d1e84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves the (start_time, show_id) ordering and cursor of /shows.
+    op.create_index('ix_shows_start_time_show_id', 'Shows',
+                    ['start_time', 'show_id'])
+
+
+def downgrade():
+    op.drop_index('ix_shows_start_time_show_id', table_name='Shows')
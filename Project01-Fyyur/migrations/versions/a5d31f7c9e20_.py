@@ -0,0 +1,33 @@
+"""soft delete venues and artists
+
+Revision ID: a5d31f7c9e20
+Revises: e2a8b7c90f15
+Create Date: 2026-10-18 14:52:08.196344
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d31f7c9e20'
+down_revision = 'e2a8b7c90f15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Deleting only stamps deleted_at; `flask purge-deleted` removes the
+    # rows and their shows later. The partial indexes hold only the rows
+    # waiting to be purged, so finding them stays cheap.
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        op.create_index('ix_{}_deleted_at'.format(table.lower()), table,
+                        ['deleted_at'],
+                        postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_index('ix_{}_deleted_at'.format(table.lower()), table_name=table)
+        op.drop_column(table, 'deleted_at')
@@ -0,0 +1,66 @@
+"""show durations and double booking constraints
+
+Revision ID: b8e4c2d61f37
+Revises: a5d31f7c9e20
+Create Date: 2026-10-18 15:36:44.520981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e4c2d61f37'
+down_revision = 'a5d31f7c9e20'
+branch_labels = None
+depends_on = None
+
+
+# Time booked by a show. start_time has no time zone, hence tsrange.
+# Shows without a duration book an empty range and never conflict.
+SHOW_RANGE = ("tsrange(start_time, start_time + "
+              "coalesce(duration, 0) * interval '1 minute')")
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('Shows', sa.Column('duration', sa.Integer(), nullable=True))
+
+    # Existing shows get the default two hours unless that would overlap a
+    # neighbouring show of the same venue or artist; those keep no
+    # duration so the constraints below can be added over old data.
+    op.execute("""
+        UPDATE "Shows" s SET duration = 120
+        FROM (
+            SELECT show_id,
+                lag(start_time) OVER venue_shows AS venue_prev,
+                lead(start_time) OVER venue_shows AS venue_next,
+                lag(start_time) OVER artist_shows AS artist_prev,
+                lead(start_time) OVER artist_shows AS artist_next,
+                start_time
+            FROM "Shows"
+            WINDOW venue_shows AS (PARTITION BY venue_id ORDER BY start_time),
+                artist_shows AS (PARTITION BY artist_id ORDER BY start_time)
+        ) n
+        WHERE s.show_id = n.show_id
+            AND coalesce(n.venue_prev + interval '120 minutes' <= n.start_time, true)
+            AND coalesce(n.venue_next >= n.start_time + interval '120 minutes', true)
+            AND coalesce(n.artist_prev + interval '120 minutes' <= n.start_time, true)
+            AND coalesce(n.artist_next >= n.start_time + interval '120 minutes', true)
+    """)
+    op.alter_column('Shows', 'duration', server_default='120')
+    op.create_check_constraint('ck_shows_duration', 'Shows', 'duration > 0')
+
+    # The GiST indexes behind the constraints also serve the venue
+    # availability query.
+    op.execute('ALTER TABLE "Shows" ADD CONSTRAINT ex_shows_venue_booking '
+               'EXCLUDE USING gist (venue_id WITH =, {} WITH &&)'.format(SHOW_RANGE))
+    op.execute('ALTER TABLE "Shows" ADD CONSTRAINT ex_shows_artist_booking '
+               'EXCLUDE USING gist (artist_id WITH =, {} WITH &&)'.format(SHOW_RANGE))
+
+
+def downgrade():
+    op.drop_constraint('ex_shows_artist_booking', 'Shows')
+    op.drop_constraint('ex_shows_venue_booking', 'Shows')
+    op.drop_constraint('ck_shows_duration', 'Shows')
+    op.drop_column('Shows', 'duration')
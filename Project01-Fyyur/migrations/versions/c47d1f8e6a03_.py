@@ -0,0 +1,31 @@
+"""indexes for show lookups by venue and artist
+
+Revision ID: c47d1f8e6a03
+Revises: 9b6e0d4a2c51
+Create Date: 2026-10-18 12:20:09.551874
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47d1f8e6a03'
+down_revision = '9b6e0d4a2c51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serve the venue and artist pages, which filter shows by one side of
+    # the booking and split them on start_time. The (artist_id, venue_id,
+    # start_time) unique constraint already covers artist_id lookups alone,
+    # but not ordered past/upcoming scans.
+    op.create_index('ix_shows_venue_id_start_time', 'Shows',
+                    ['venue_id', 'start_time'])
+    op.create_index('ix_shows_artist_id_start_time', 'Shows',
+                    ['artist_id', 'start_time'])
+
+
+def downgrade():
+    op.drop_index('ix_shows_artist_id_start_time', table_name='Shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='Shows')
@@ -0,0 +1,38 @@
+"""venue coordinates and spatial index
+
+Revision ID: d71c3a9e4b58
+Revises: b8e4c2d61f37
+Create Date: 2026-10-18 17:02:13.408116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd71c3a9e4b58'
+down_revision = 'b8e4c2d61f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # earthdistance maps coordinates to points of a cube, which GiST
+    # indexes and orders by distance, without needing PostGIS.
+    op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+    op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+
+    # Venues are geocoded afterwards by `flask geocode-venues`. They sit
+    # on city centroids, so many share a point; id (through btree_gist)
+    # lets GiST split pages of identical points instead of degrading.
+    op.execute('CREATE INDEX ix_venue_location ON "Venue" '
+               'USING gist (ll_to_earth(latitude, longitude), id) '
+               'WHERE deleted_at IS NULL AND latitude IS NOT NULL')
+
+
+def downgrade():
+    op.drop_index('ix_venue_location', table_name='Venue')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
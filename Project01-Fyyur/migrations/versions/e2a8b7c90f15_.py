@@ -0,0 +1,105 @@
+"""materialized upcoming show counters
+
+Revision ID: e2a8b7c90f15
+Revises: c47d1f8e6a03
+Create Date: 2026-10-18 13:41:55.730218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a8b7c90f15'
+down_revision = 'c47d1f8e6a03'
+branch_labels = None
+depends_on = None
+
+
+# Venue/Artist.upcoming_shows_count counts the shows starting after the
+# watermark in show_counter_sweep. Statement level triggers keep it in step
+# with writes to Shows, and `flask sweep-counters` moves the watermark
+# forward, subtracting the shows it passes. Triggers hold a share lock on
+# the watermark row until they commit so a sweep never misses a write.
+COUNTER_FUNCTION = """
+CREATE FUNCTION shows_upcoming_counter() RETURNS trigger AS $$
+DECLARE
+    watermark timestamp;
+BEGIN
+    SELECT swept_at INTO watermark FROM show_counter_sweep FOR SHARE;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE "Venue" v SET upcoming_shows_count = upcoming_shows_count - d.n
+        FROM (SELECT venue_id, count(*) AS n FROM old_rows
+              WHERE start_time > watermark GROUP BY venue_id) d
+        WHERE v.id = d.venue_id;
+        UPDATE "Artist" a SET upcoming_shows_count = upcoming_shows_count - d.n
+        FROM (SELECT artist_id, count(*) AS n FROM old_rows
+              WHERE start_time > watermark GROUP BY artist_id) d
+        WHERE a.id = d.artist_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE "Venue" v SET upcoming_shows_count = upcoming_shows_count + d.n
+        FROM (SELECT venue_id, count(*) AS n FROM new_rows
+              WHERE start_time > watermark GROUP BY venue_id) d
+        WHERE v.id = d.venue_id;
+        UPDATE "Artist" a SET upcoming_shows_count = upcoming_shows_count + d.n
+        FROM (SELECT artist_id, count(*) AS n FROM new_rows
+              WHERE start_time > watermark GROUP BY artist_id) d
+        WHERE a.id = d.artist_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade():
+    op.create_table('show_counter_sweep',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('swept_at', sa.DateTime(), nullable=False),
+    sa.CheckConstraint('id = 1'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO show_counter_sweep (id, swept_at) "
+               "VALUES (1, localtimestamp)")
+
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+        op.execute("""
+            UPDATE "{table}" t SET upcoming_shows_count = d.n
+            FROM (SELECT {column}, count(*) AS n FROM "Shows"
+                  WHERE start_time > (SELECT swept_at FROM show_counter_sweep)
+                  GROUP BY {column}) d
+            WHERE t.id = d.{column}
+        """.format(table=table, column=column))
+
+    op.execute(COUNTER_FUNCTION)
+    op.execute("""
+        CREATE TRIGGER shows_upcoming_insert AFTER INSERT ON "Shows"
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE shows_upcoming_counter()
+    """)
+    op.execute("""
+        CREATE TRIGGER shows_upcoming_update AFTER UPDATE ON "Shows"
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE shows_upcoming_counter()
+    """)
+    op.execute("""
+        CREATE TRIGGER shows_upcoming_delete AFTER DELETE ON "Shows"
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE shows_upcoming_counter()
+    """)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER shows_upcoming_delete ON "Shows"')
+    op.execute('DROP TRIGGER shows_upcoming_update ON "Shows"')
+    op.execute('DROP TRIGGER shows_upcoming_insert ON "Shows"')
+    op.execute('DROP FUNCTION shows_upcoming_counter()')
+    op.drop_column('Artist', 'upcoming_shows_count')
+    op.drop_column('Venue', 'upcoming_shows_count')
+    op.drop_table('show_counter_sweep')
@@ -0,0 +1,30 @@
+"""row versions of venues and artists
+
+Revision ID: f3b9e6a1c824
+Revises: d71c3a9e4b58
+Create Date: 2026-10-18 17:48:51.230457
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9e6a1c824'
+down_revision = 'd71c3a9e4b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Bumped by every edit, so an edit based on a stale form is refused
+    # instead of silently overwriting the changes made in between.
+    op.add_column('Venue', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+    op.add_column('Artist', sa.Column('version', sa.Integer(), nullable=False,
+                                      server_default='1'))
+
+
+def downgrade():
+    op.drop_column('Artist', 'version')
+    op.drop_column('Venue', 'version')
@@ -0,0 +1,139 @@
+import heapq
+import json
+import logging
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_log = logging.getLogger("fyyur.sql")
+request_log = logging.getLogger("fyyur.requests")
+
+
+def digest(statement, length=200):
+    """
+    Collapse the whitespace of a SQL statement and cut it to `length`.
+    """
+    return " ".join(statement.split())[:length]
+
+
+class RequestProfile:
+    """
+    Statements issued while serving one request: how many, the time
+    spent in the database and the `top_n` slowest of them.
+    """
+
+    def __init__(self, top_n):
+        self.top_n = top_n
+        self.started = time.perf_counter()
+        self.count = 0
+        self.db_time = 0.0
+        self.slowest = []
+        self.status = None
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.db_time += elapsed
+        entry = (elapsed, self.count, statement)
+        if len(self.slowest) < self.top_n:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def top(self):
+        return [(elapsed, statement)
+                for elapsed, _, statement in sorted(self.slowest, reverse=True)]
+
+
+class SQLProfiler:
+    """
+    Time every statement sent through SQLAlchemy. Statements slower than
+    SLOW_QUERY_THRESHOLD_MS go to the `fyyur.sql` log; per request totals
+    are sent in a Server-Timing header and logged to `fyyur.requests`
+    once the response, streamed or not, is complete.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SQL_PROFILER_ENABLED", True)
+        app.config.setdefault("SQL_PROFILER_TOP_N", 5)
+        app.config.setdefault("SQL_PROFILER_EXPOSE_STATEMENTS", False)
+        app.config.setdefault("SLOW_QUERY_THRESHOLD_MS", 200)
+        self.app = app
+
+        event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+        app.before_request(self.start_request)
+        app.after_request(self.add_server_timing)
+        app.teardown_request(self.log_request)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        if context is not None:
+            context._profiler_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        started = getattr(context, "_profiler_started", None)
+        if started is None or not self.app.config["SQL_PROFILER_ENABLED"]:
+            return
+        elapsed = time.perf_counter() - started
+
+        profile = g.get("sql_profile") if has_request_context() else None
+        if profile is not None:
+            profile.record(statement, elapsed)
+
+        if elapsed * 1000 >= self.app.config["SLOW_QUERY_THRESHOLD_MS"]:
+            slow_query_log.warning(json.dumps({
+                "duration_ms": round(elapsed * 1000, 2),
+                "path": request.path if has_request_context() else None,
+                "statement": digest(statement),
+            }))
+
+    def start_request(self):
+        if self.app.config["SQL_PROFILER_ENABLED"]:
+            g.sql_profile = RequestProfile(self.app.config["SQL_PROFILER_TOP_N"])
+
+    def add_server_timing(self, response):
+        """
+        Report the statements issued so far. For streamed responses the
+        header only covers the work done before the first chunk is sent.
+        """
+        profile = g.get("sql_profile")
+        if profile is None:
+            return response
+        profile.status = response.status_code
+
+        metrics = ['db;dur={:.2f};desc="{} queries"'.format(
+            profile.db_time * 1000, profile.count)]
+        if self.app.config["SQL_PROFILER_EXPOSE_STATEMENTS"]:
+            for rank, (elapsed, statement) in enumerate(profile.top(), 1):
+                description = digest(statement, 100).replace("\\", "").replace('"', "'")
+                metrics.append('sql{};dur={:.2f};desc="{}"'.format(
+                    rank, elapsed * 1000, description))
+        metrics.append("app;dur={:.2f}".format(
+            (time.perf_counter() - profile.started) * 1000))
+
+        response.headers.add("Server-Timing", ", ".join(metrics))
+        return response
+
+    def log_request(self, exception=None):
+        profile = g.pop("sql_profile", None)
+        if profile is None:
+            return
+        request_log.info(json.dumps({
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": profile.status,
+            "duration_ms": round((time.perf_counter() - profile.started) * 1000, 2),
+            "queries": profile.count,
+            "db_ms": round(profile.db_time * 1000, 2),
+            "slowest": [{"ms": round(elapsed * 1000, 2), "statement": digest(statement)}
+                        for elapsed, statement in profile.top()],
+            "error": repr(exception) if exception is not None else None,
+        }))
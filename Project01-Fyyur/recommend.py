@@ -0,0 +1,245 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+# A seeking artist as kept in memory: genres as a frozenset, city
+# lowercased for comparisons.
+Candidate = namedtuple("Candidate", "name genres city state")
+
+Recommendation = namedtuple("Recommendation", "id name score bookings")
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ArtistIndex:
+    """
+    Seeking artists by id, with an inverted index from each genre to the
+    ids of the artists playing it.
+    """
+
+    def __init__(self, rows=()):
+        self.artists = {}
+        self.by_genre = defaultdict(set)
+        for row in rows:
+            self.put(row)
+
+    def put(self, row):
+        self.remove(row.id)
+        candidate = Candidate(row.name, frozenset(row.genres),
+                              row.city.lower(), row.state)
+        self.artists[row.id] = candidate
+        for genre in candidate.genres:
+            self.by_genre[genre].add(row.id)
+
+    def remove(self, artist_id):
+        candidate = self.artists.pop(artist_id, None)
+        if candidate is None:
+            return
+        for genre in candidate.genres:
+            ids = self.by_genre[genre]
+            ids.discard(artist_id)
+            if not ids:
+                del self.by_genre[genre]
+
+    def sharing_genres(self, genres):
+        """
+        Return the ids of the artists playing any of `genres`.
+        """
+        ids = set()
+        for genre in genres:
+            ids |= self.by_genre.get(genre, set())
+        return ids
+
+
+class Recommender:
+    """
+    Rank the seeking artists for a venue by genre overlap (Jaccard over
+    the genre sets), location (same city, else same state) and the
+    number of past shows they played there, weighted by RECOMMEND_WEIGHTS.
+
+    The artist index is loaded once per process and patched by
+    artist_changed(); rankings are computed on a venue's first request
+    and kept, up to RECOMMEND_MAX_VENUES, until something they depend on
+    changes. Changes made by other processes are picked up by a full
+    reload every RECOMMEND_MAX_AGE seconds, made by one request while
+    the others keep using the index loaded before.
+
+    The lock only guards reading and replacing the index and rankings;
+    queries and ranking run outside it, so a cold venue or a reload does
+    not hold up the requests answered from memory.
+
+    The data comes from three callables, so this module knows nothing
+    of the models:
+        load_artists(ids=None): seeking artists as rows with id, name,
+            genres, city and state, restricted to `ids` if given
+        load_venue(venue_id): row with genres, city and state, or None
+        load_bookings(venue_id): {artist_id: number of past shows}
+    """
+
+    def __init__(self, app=None, load_artists=None, load_venue=None,
+                 load_bookings=None):
+        self.load_artists = load_artists
+        self.load_venue = load_venue
+        self.load_bookings = load_bookings
+        self.index = None
+        self.loaded_at = 0.0
+        self.rankings = OrderedDict()
+        # Bumped whenever rankings are dropped, so a ranking computed
+        # from older data is not kept.
+        self.generation = 0
+        # Artists changed while the index is being reloaded, patched
+        # again into the reloaded index.
+        self.changed_while_loading = None
+        self.lock = threading.Lock()
+        self.loading = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RECOMMEND_LIMIT", 20)
+        app.config.setdefault("RECOMMEND_MAX_VENUES", 10000)
+        app.config.setdefault("RECOMMEND_MAX_AGE", 300)
+        app.config.setdefault("RECOMMEND_WEIGHTS", {
+            "genres": 0.6, "location": 0.25, "bookings": 0.15})
+        app.config.setdefault("RECOMMEND_BOOKINGS_CAP", 5)
+        self.app = app
+
+    def artist_index(self):
+        """
+        Return the artist index, loading it first if there is none yet.
+        Once it is too old, the first request to get the reload lock
+        reloads it; the others go on with the current one.
+        """
+        with self.lock:
+            index = self.index
+            expired = index is None or \
+                time.monotonic() - self.loaded_at > self.app.config["RECOMMEND_MAX_AGE"]
+        if not expired:
+            return index
+
+        if index is None:
+            self.loading.acquire()
+        elif not self.loading.acquire(blocking=False):
+            return index
+        try:
+            with self.lock:
+                # Reloaded by another request while this one waited.
+                if self.index is not index:
+                    return self.index
+                self.changed_while_loading = set()
+
+            loaded = ArtistIndex(self.load_artists())
+            with self.lock:
+                changed = self.changed_while_loading
+                self.changed_while_loading = None
+            rows = self.load_artists(list(changed)) if changed else []
+
+            with self.lock:
+                for artist_id in changed:
+                    loaded.remove(artist_id)
+                for row in rows:
+                    loaded.put(row)
+                self.index = loaded
+                self.loaded_at = time.monotonic()
+                self.rankings.clear()
+                self.generation += 1
+                return loaded
+        finally:
+            self.loading.release()
+
+    def recommend(self, venue_id):
+        """
+        Return the ranked Recommendations for a venue, or None if the
+        venue does not exist.
+        """
+        index = self.artist_index()
+        with self.lock:
+            ranking = self.rankings.get(venue_id)
+            if ranking is not None:
+                self.rankings.move_to_end(venue_id)
+                return ranking
+            generation = self.generation
+
+        venue = self.load_venue(venue_id)
+        if venue is None:
+            return None
+        ranking = self.rank(index, venue, self.load_bookings(venue_id))
+
+        with self.lock:
+            if self.generation == generation and self.index is index:
+                self.rankings[venue_id] = ranking
+                while len(self.rankings) > self.app.config["RECOMMEND_MAX_VENUES"]:
+                    self.rankings.popitem(last=False)
+        return ranking
+
+    def rank(self, index, venue, bookings):
+        config = self.app.config
+        weights = config["RECOMMEND_WEIGHTS"]
+        cap = config["RECOMMEND_BOOKINGS_CAP"]
+        genres = frozenset(venue.genres)
+        city = venue.city.lower()
+
+        # Artists sharing no genre with the venue are only considered if
+        # they played there before. The index may be patched by
+        # artist_changed() meanwhile, so the candidates are collected
+        # under the lock and looked up one at a time.
+        with self.lock:
+            ids = index.sharing_genres(genres)
+            ids.update(artist_id for artist_id in bookings
+                       if artist_id in index.artists)
+
+        ranking = []
+        for artist_id in ids:
+            artist = index.artists.get(artist_id)
+            if artist is None:
+                continue
+            if artist.state == venue.state:
+                location = 1.0 if artist.city == city else 0.5
+            else:
+                location = 0.0
+            played = bookings.get(artist_id, 0)
+            score = weights["genres"] * jaccard(genres, artist.genres) + \
+                weights["location"] * location + \
+                weights["bookings"] * min(played, cap) / cap
+            ranking.append(Recommendation(artist_id, artist.name, round(score, 4), played))
+
+        return heapq.nlargest(config["RECOMMEND_LIMIT"], ranking,
+                              key=lambda r: (r.score, -r.id))
+
+    def artist_changed(self, artist_id):
+        """
+        Reload one artist after it was created, edited or deleted.
+        Rankings are dropped since the artist may enter or leave any.
+        """
+        with self.lock:
+            if self.index is None and self.changed_while_loading is None:
+                return
+        rows = self.load_artists([artist_id])
+        with self.lock:
+            if self.changed_while_loading is not None:
+                self.changed_while_loading.add(artist_id)
+            if self.index is not None:
+                self.index.remove(artist_id)
+                for row in rows:
+                    self.index.put(row)
+            self.rankings.clear()
+            self.generation += 1
+
+    def venue_changed(self, venue_id):
+        """
+        Drop the ranking of a venue after it was edited or booked.
+        """
+        with self.lock:
+            self.rankings.pop(venue_id, None)
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.index = None
+            self.rankings.clear()
+            self.generation += 1
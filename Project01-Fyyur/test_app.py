@@ -0,0 +1,805 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from recommend import Recommender
+
+from app import (app, db, cache, recommender, Venue, Artist, Shows, ShowCounterSweep,
+                 format_datetime, sweep_counters_once, check_counters,
+                 purge_deleted_once, geocode_venues, import_data, explainable,
+                 advise_indexes)
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        app.config["TESTING"] = True
+        app.config["WTF_CSRF_ENABLED"] = False
+        app.config["CACHE_ENABLED"] = False
+        self.client = app.test_client
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     self.count_statement)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        event.remove(db.engine, "before_cursor_execute",
+                     self.count_statement)
+        db.session.rollback()
+        Shows.query.filter(Shows.artist_id.in_(
+            db.session.query(Artist.id).filter(Artist.name.like("test-%"))
+        )).delete(synchronize_session=False)
+        Venue.query.filter(Venue.name.like("test-%")) \
+            .delete(synchronize_session=False)
+        Artist.query.filter(Artist.name.like("test-%")) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def count_statement(self, conn, cursor, statement, parameters,
+                        context, executemany):
+        self.statements.append(statement)
+
+    def add_venue(self, city, state="CA"):
+        venue = Venue(name="test-venue-" + city, city=city, state=state,
+                      address="1 Test St", phone="123-123-1234",
+                      genres=["Jazz"], facebook_link="https://fb.com/test")
+        db.session.add(venue)
+        return venue
+
+    def add_artist(self, name):
+        artist = Artist(name="test-" + name, city="Test City", state="CA",
+                        phone="123-123-1234", genres=["Jazz"],
+                        facebook_link="https://fb.com/test")
+        db.session.add(artist)
+        return artist
+
+    def add_show(self, venue, artist, start_time):
+        db.session.add(Shows(venue_id=venue.id, artist_id=artist.id,
+                             start_time=start_time))
+
+    def seed_cities(self, count):
+        artist = self.add_artist("artist-" + str(count))
+        venues = [self.add_venue("test-city-{}-{}".format(count, i))
+                  for i in range(count)]
+        db.session.flush()
+        # The artist plays the venues a few hours apart, so the
+        # bookings do not overlap.
+        for i, venue in enumerate(venues):
+            offset = timedelta(days=7, hours=3 * i)
+            self.add_show(venue, artist, datetime.now() + offset)
+            self.add_show(venue, artist, datetime.now() - offset)
+        db.session.commit()
+
+    def get_statement_count(self, url):
+        self.statements = []
+        res = self.client().get(url)
+        self.assertEqual(res.status_code, 200)
+        return len(self.statements)
+
+    def test_venues_lists_upcoming_shows_per_area(self):
+        self.seed_cities(2)
+
+        res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b"test-city-2-0", res.data)
+        self.assertIn(b"test-venue-test-city-2-1", res.data)
+
+    def test_venues_statement_count_is_constant(self):
+        self.seed_cities(2)
+        statements_before = self.get_statement_count('/venues')
+
+        self.seed_cities(20)
+        statements_after = self.get_statement_count('/venues')
+
+        self.assertEqual(statements_before, statements_after)
+        self.assertEqual(statements_after, 1)
+
+    def test_venue_page_caps_past_shows(self):
+        app.config["PAST_SHOWS_LIMIT"] = 2
+        self.addCleanup(app.config.__setitem__, "PAST_SHOWS_LIMIT", 50)
+        venue = self.add_venue("test-city-detail")
+        artist = self.add_artist("artist-detail")
+        db.session.flush()
+        venue_id = venue.id
+        for days in range(1, 6):
+            self.add_show(venue, artist, datetime.now() - timedelta(days=days))
+        self.add_show(venue, artist, datetime.now() + timedelta(days=1))
+        db.session.commit()
+
+        res = self.client().get('/venues/{}'.format(venue_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b"5 Past Shows", res.data)
+        self.assertIn(b"1 Upcoming Show", res.data)
+        self.assertIn(b"load-past-shows", res.data)
+
+    def test_venue_past_shows_cursor_pages_through_history(self):
+        app.config["PAST_SHOWS_LIMIT"] = 2
+        self.addCleanup(app.config.__setitem__, "PAST_SHOWS_LIMIT", 50)
+        venue = self.add_venue("test-city-cursor")
+        artist = self.add_artist("artist-cursor")
+        db.session.flush()
+        venue_id = venue.id
+        for days in range(1, 6):
+            self.add_show(venue, artist, datetime.now() - timedelta(days=days))
+        db.session.commit()
+
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            res = self.client().get(
+                '/venues/{}/past_shows?cursor={}'.format(venue_id, cursor))
+            page = res.get_json()
+            seen.extend(show["start_time"] for show in page["shows"])
+            cursor = page["cursor"]
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_search_venues_by_partial_name(self):
+        self.seed_cities(1)
+
+        res = self.client().post('/venues/search',
+                                 data={"search_term": "VENUE-test-city-1"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b"test-venue-test-city-1-0", res.data)
+        self.assertIn(b": 1</h3>", res.data)
+
+    def test_search_artists_by_city_and_state(self):
+        self.add_artist("artist-search")
+        db.session.commit()
+
+        res = self.client().post('/artists/search',
+                                 data={"search_term": "test city, ca"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b"test-artist-search", res.data)
+
+    def test_search_venues_is_paginated(self):
+        app.config["SEARCH_RESULTS_PER_PAGE"] = 2
+        self.addCleanup(app.config.__setitem__, "SEARCH_RESULTS_PER_PAGE", 20)
+        self.seed_cities(3)
+
+        res = self.client().post('/venues/search', data={
+            "search_term": "test-venue-test-city-3", "page": 2})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b": 3</h3>", res.data)
+        self.assertIn(b"Page 2 of 2", res.data)
+        self.assertEqual(res.data.count(b"<h5>test-venue-test-city-3-"), 1)
+
+    def test_shows_cursor_pages_through_feed(self):
+        app.config["SHOWS_PER_PAGE"] = 2
+        self.addCleanup(app.config.__setitem__, "SHOWS_PER_PAGE", 30)
+        venue = self.add_venue("test-city-feed")
+        artist = self.add_artist("artist-feed")
+        db.session.flush()
+        venue_id = venue.id
+        for days in range(5):
+            self.add_show(venue, artist, datetime(2030, 1, 1) + timedelta(days=days))
+        db.session.commit()
+
+        url = '/shows?venue_id={}&from=2030-01-02&to=2030-01-04'.format(venue_id)
+        pages = 0
+        seen = 0
+        while url:
+            res = self.client().get(url)
+            self.assertEqual(res.status_code, 200)
+            seen += res.data.count(b"test-artist-feed")
+            match = re.search(rb'href="(/shows\?[^"]+)"', res.data)
+            url = match.group(1).decode().replace("&amp;", "&") if match else None
+            pages += 1
+
+        self.assertEqual(seen, 3)
+        self.assertEqual(pages, 2)
+
+    def test_format_datetime_accepts_datetimes_and_strings(self):
+        value = datetime(2030, 5, 21, 21, 30)
+
+        self.assertEqual(format_datetime(value, 'full'),
+                         "Tuesday May, 21, 2030 at 9:30PM")
+        self.assertEqual(format_datetime(str(value), 'full'),
+                         format_datetime(value, 'full'))
+
+    def test_venues_served_from_cache_until_a_venue_is_created(self):
+        app.config["CACHE_ENABLED"] = True
+        cache.clear()
+        self.seed_cities(1)
+
+        self.get_statement_count('/venues')
+        self.assertEqual(self.get_statement_count('/venues'), 0)
+
+        res = self.client().post('/venues/create', data={
+            "name": "test-venue-cached", "city": "test-city-cached",
+            "state": "CA", "address": "1 Test St", "phone": "123",
+            "genres": "Jazz", "facebook_link": "https://fb.com/test"})
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/venues')
+        self.assertEqual(res.headers["X-Cache"], "MISS")
+        self.assertIn(b"test-venue-cached", res.data)
+
+    def test_cached_page_honours_etag(self):
+        app.config["CACHE_ENABLED"] = True
+        cache.clear()
+
+        etag = self.client().get('/artists').headers["ETag"]
+        res = self.client().get('/artists', headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["X-Cache"], "HIT")
+
+    def test_venues_streamed_from_server_side_cursor(self):
+        app.config["STREAM_LISTINGS"] = True
+        self.addCleanup(app.config.__setitem__, "STREAM_LISTINGS", False)
+        self.seed_cities(2)
+
+        res = self.client().get('/venues')
+
+        self.assertTrue(res.is_streamed)
+        self.assertIn(b"test-venue-test-city-2-1", res.data)
+
+    def test_shows_streamed_with_next_page(self):
+        app.config["STREAM_LISTINGS"] = True
+        app.config["SHOWS_PER_PAGE"] = 1
+        self.addCleanup(app.config.__setitem__, "STREAM_LISTINGS", False)
+        self.addCleanup(app.config.__setitem__, "SHOWS_PER_PAGE", 30)
+        self.seed_cities(2)
+
+        res = self.client().get('/shows')
+
+        self.assertTrue(res.is_streamed)
+        self.assertIn(b"cursor=", res.data)
+
+    def test_upcoming_counters_follow_writes_and_sweeps(self):
+        sweep_counters_once()
+        watermark = ShowCounterSweep.query.one().swept_at
+        venue = self.add_venue("test-city-counter")
+        artist = self.add_artist("artist-counter")
+        db.session.flush()
+        self.add_show(venue, artist, datetime.now() + timedelta(days=7))
+        self.add_show(venue, artist, watermark + timedelta(microseconds=1))
+        self.add_show(venue, artist, watermark - timedelta(days=7))
+        db.session.commit()
+
+        self.assertEqual(venue.upcoming_shows_count, 2)
+        self.assertEqual(artist.upcoming_shows_count, 2)
+
+        sweep_counters_once()
+
+        self.assertEqual(venue.upcoming_shows_count, 1)
+        self.assertEqual(artist.upcoming_shows_count, 1)
+
+        Shows.query.filter_by(venue_id=venue.id).delete()
+        db.session.commit()
+
+        self.assertEqual(venue.upcoming_shows_count, 0)
+
+    def test_check_counters_reports_and_fixes_drift(self):
+        self.seed_cities(1)
+        venue = Venue.query.filter_by(name="test-venue-test-city-1-0").one()
+        venue.upcoming_shows_count = 5
+        db.session.commit()
+        venue_id = venue.id
+
+        result = app.test_cli_runner().invoke(check_counters)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Venue {}: stored 5, actual 1".format(venue_id),
+                      result.output)
+
+        result = app.test_cli_runner().invoke(check_counters, ["--fix"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(db.session.query(Venue.upcoming_shows_count)
+                         .filter_by(name="test-venue-test-city-1-0").scalar(), 1)
+
+    def test_pool_stats_report_checkouts(self):
+        self.client().get('/venues')
+        res = self.client().get('/_internal/pool')
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["size"], app.config["DB_POOL_SIZE"])
+        self.assertGreater(data["checkouts"], 0)
+        self.assertEqual(data["wait_seconds"]["count"], data["checkouts"])
+
+    def test_pool_metrics_in_prometheus_format(self):
+        res = self.client().get('/_internal/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b"# TYPE fyyur_db_pool_checked_out gauge", res.data)
+        self.assertIn(b'fyyur_db_pool_wait_seconds_bucket{le="+Inf"}', res.data)
+
+    def test_internal_endpoints_hidden_from_other_clients(self):
+        res = self.client().get('/_internal/pool',
+                                environ_base={"REMOTE_ADDR": "203.0.113.7"})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_server_timing_reports_statement_count(self):
+        self.seed_cities(1)
+        res = self.client().get('/venues')
+
+        timing = res.headers["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[0-9.]+;desc="1 queries"')
+        self.assertRegex(timing, r'app;dur=[0-9.]+$')
+        self.assertNotIn("SELECT", timing)
+
+    def test_requests_and_slow_queries_are_logged(self):
+        app.config["SLOW_QUERY_THRESHOLD_MS"] = 0
+        self.addCleanup(app.config.__setitem__, "SLOW_QUERY_THRESHOLD_MS", 200)
+
+        with self.assertLogs("fyyur", "INFO") as logs:
+            self.client().get('/artists')
+
+        slow = [json.loads(record.getMessage()) for record in logs.records
+                if record.name == "fyyur.sql"]
+        logged = [json.loads(record.getMessage()) for record in logs.records
+                  if record.name == "fyyur.requests"]
+        self.assertTrue(slow)
+        self.assertEqual(slow[0]["path"], "/artists")
+        self.assertEqual(logged[0]["path"], "/artists")
+        self.assertEqual(logged[0]["status"], 200)
+        self.assertEqual(logged[0]["queries"], len(slow))
+
+    def test_genre_shows_lists_upcoming_shows_in_state(self):
+        artist = self.add_artist("artist-genre")
+        in_state = self.add_venue("test-city-genre-ca", state="CA")
+        out_of_state = self.add_venue("test-city-genre-ny", state="NY")
+        db.session.flush()
+        self.add_show(in_state, artist, datetime(2099, 1, 1, 20))
+        self.add_show(in_state, artist, datetime(2001, 1, 1, 20))
+        self.add_show(out_of_state, artist, datetime(2099, 1, 2, 20))
+        db.session.commit()
+
+        res = self.client().get('/genres/jazz/shows?state=ca&artist_id={}'
+                                .format(artist.id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b"Upcoming Jazz shows in CA", res.data)
+        self.assertEqual(res.data.count(b"test-venue-test-city-genre-ca"), 1)
+        self.assertNotIn(b"test-venue-test-city-genre-ny", res.data)
+
+    def test_genre_shows_unknown_genre(self):
+        res = self.client().get('/genres/polka/shows')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_create_venue_rejects_unknown_state(self):
+        res = self.client().post('/venues/create', data={
+            "name": "test-venue-bad-state", "city": "Nowhere", "state": "XX",
+            "address": "1 Test St", "phone": "123-123-1234",
+            "genres": ["jazz"], "facebook_link": "https://fb.com/test"})
+
+        self.assertIn(b"could not be listed", res.data)
+        self.assertIsNone(Venue.query.filter_by(
+            name="test-venue-bad-state").first())
+
+    def test_deleted_venue_hidden_until_purged(self):
+        venue = self.add_venue("test-city-deleted")
+        artist = self.add_artist("artist-deleted")
+        db.session.flush()
+        for day in range(1, 4):
+            self.add_show(venue, artist, datetime(2099, 1, day, 20))
+        db.session.commit()
+        venue_id, artist_id = venue.id, artist.id
+
+        res = self.client().delete('/venues/{}'.format(venue_id))
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.client().get(
+            '/venues/{}'.format(venue_id)).status_code, 404)
+        self.assertNotIn(b"test-venue-test-city-deleted",
+                         self.client().get('/venues').data)
+        self.assertNotIn(b"test-venue-test-city-deleted", self.client().get(
+            '/artists/{}'.format(artist_id)).data)
+        artist_page = self.client().get(
+            '/artists/{}?format=json'.format(artist_id)).get_json()
+        self.assertEqual(artist_page["upcoming_shows_count"],
+                         len(artist_page["upcoming_shows"]))
+        self.assertEqual(artist_page["upcoming_shows_count"], 0)
+        self.assertIsNotNone(Venue.query.get(venue_id).deleted_at)
+
+        purge_deleted_once(batch_size=2)
+
+        self.assertIsNone(Venue.query.get(venue_id))
+        self.assertEqual(Shows.query.filter_by(venue_id=venue_id).count(), 0)
+        self.assertEqual(Artist.query.get(artist_id).upcoming_shows_count, 0)
+
+    def test_deleting_venue_updates_artist_counters_before_purge(self):
+        venue = self.add_venue("test-city-uncounted")
+        other = self.add_venue("test-city-uncounted-other")
+        artist = self.add_artist("artist-uncounted")
+        db.session.flush()
+        self.add_show(venue, artist, datetime(2099, 2, 1, 20))
+        self.add_show(venue, artist, datetime(2099, 2, 2, 20))
+        self.add_show(other, artist, datetime(2099, 2, 3, 20))
+        db.session.commit()
+        venue_id, artist_id = venue.id, artist.id
+
+        def listed_count():
+            res = self.client().post('/artists/search?format=json', data={
+                "search_term": "test-artist-uncounted"})
+            return res.get_json()["data"][0]["num_upcoming_shows"]
+
+        self.assertEqual(listed_count(), 3)
+        self.client().delete('/venues/{}'.format(venue_id))
+
+        self.assertEqual(listed_count(), 1)
+        self.assertEqual(listed_count(), self.client().get(
+            '/artists/{}?format=json'.format(artist_id)).get_json()
+            ["upcoming_shows_count"])
+        result = app.test_cli_runner().invoke(check_counters)
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        purge_deleted_once(batch_size=10)
+        self.assertEqual(listed_count(), 1)
+
+    def test_delete_artist_flashes_success(self):
+        artist = self.add_artist("artist-delete-flash")
+        db.session.commit()
+
+        res = self.client().delete('/artists/{}'.format(artist.id))
+
+        self.assertIn(b"Artist was deleted", res.data)
+        self.assertNotIn(b"could not be deleted", res.data)
+
+    def test_double_booking_is_rejected(self):
+        venue = self.add_venue("test-city-booking")
+        artist = self.add_artist("artist-booking")
+        other = self.add_artist("artist-booking-other")
+        db.session.flush()
+        self.add_show(venue, artist, datetime(2099, 3, 1, 20))
+        db.session.commit()
+
+        res = self.client().post('/shows/create', data={
+            "venue_id": venue.id, "artist_id": other.id,
+            "start_time": "2099-03-01 21:00:00", "duration": 60})
+
+        self.assertIn(b"already booked at that time", res.data)
+        self.assertEqual(Shows.query.filter_by(venue_id=venue.id).count(), 1)
+
+        res = self.client().post('/shows/create', data={
+            "venue_id": venue.id, "artist_id": other.id,
+            "start_time": "2099-03-01 22:00:00", "duration": 60})
+
+        self.assertIn(b"Show was successfully listed", res.data)
+
+    def test_venue_availability_lists_free_slots(self):
+        venue = self.add_venue("test-city-availability")
+        artist = self.add_artist("artist-availability")
+        db.session.flush()
+        self.add_show(venue, artist, datetime(2099, 4, 1, 12))
+        self.add_show(venue, artist, datetime(2099, 4, 1, 18))
+        db.session.commit()
+
+        res = self.client().get(
+            '/venues/{}/availability?start=2099-04-01&end=2099-04-01'
+            .format(venue.id))
+
+        self.assertEqual(res.get_json()["slots"], [
+            {"start": "2099-04-01T00:00:00", "end": "2099-04-01T12:00:00"},
+            {"start": "2099-04-01T14:00:00", "end": "2099-04-01T18:00:00"},
+            {"start": "2099-04-01T20:00:00", "end": "2099-04-02T00:00:00"},
+        ])
+
+    def test_venue_page_as_json_with_selected_fields(self):
+        venue = self.add_venue("test-city-json")
+        artist = self.add_artist("artist-json")
+        db.session.flush()
+        self.add_show(venue, artist, datetime(2099, 5, 1, 20))
+        db.session.commit()
+
+        res = self.client().get(
+            '/venues/{}?fields=id,name,upcoming_shows'.format(venue.id),
+            headers={"Accept": "application/json"})
+
+        self.assertEqual(res.mimetype, "application/json")
+        self.assertEqual(res.get_json(), {
+            "id": venue.id,
+            "name": "test-venue-test-city-json",
+            "upcoming_shows": [{
+                "artist_id": artist.id,
+                "artist_name": "test-artist-json",
+                "artist_image_link": artist.image_link,
+                "start_time": "2099-05-01T20:00:00",
+            }],
+        })
+
+    def test_listings_negotiate_html_and_json_separately_in_cache(self):
+        app.config["CACHE_ENABLED"] = True
+        cache.clear()
+        venue = self.add_venue("test-city-negotiate")
+        db.session.commit()
+
+        html = self.client().get('/venues')
+        data = self.client().get('/venues', headers={"Accept": "application/json"})
+        html_again = self.client().get('/venues')
+
+        self.assertEqual(html.mimetype, "text/html")
+        self.assertEqual(data.headers["X-Cache"], "MISS")
+        self.assertIn("Accept", data.headers["Vary"])
+        area = [area for area in data.get_json()["areas"]
+                if area["city"] == "test-city-negotiate"][0]
+        self.assertEqual(area["venues"], [{
+            "id": venue.id,
+            "name": "test-venue-test-city-negotiate",
+            "num_upcoming_shows": 0,
+        }])
+        self.assertEqual(html_again.mimetype, "text/html")
+        self.assertEqual(html_again.headers["X-Cache"], "HIT")
+
+    def test_search_as_json(self):
+        self.add_artist("artist-search-json")
+        db.session.commit()
+
+        res = self.client().post('/artists/search?format=json&fields=name',
+                                 data={"search_term": "test-artist-search-json"})
+
+        self.assertEqual(res.get_json()["count"], 1)
+        self.assertEqual(res.get_json()["data"],
+                         [{"name": "test-artist-search-json"}])
+
+    def test_large_responses_are_gzipped(self):
+        self.seed_cities(50)
+
+        res = self.client().get('/venues', headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn(b"test-city-50-49", gzip.decompress(res.data))
+
+    def test_nearby_venues_ordered_by_distance(self):
+        centre = self.add_venue("Boise", state="ID")
+        centre.geocode()
+        near = self.add_venue("test-city-near-boise", state="ID")
+        near.latitude, near.longitude = 43.70, -116.35
+        far = self.add_venue("Salt Lake City", state="UT")
+        far.geocode()
+        db.session.commit()
+
+        res = self.client().get(
+            '/venues/nearby?lat=43.615&lon=-116.2023&radius=30&fields=id,distance_km')
+
+        venues = res.get_json()["venues"]
+        self.assertEqual([venue["id"] for venue in venues], [centre.id, near.id])
+        self.assertEqual(venues[0]["distance_km"], 0)
+        self.assertAlmostEqual(venues[1]["distance_km"], 14.8, delta=0.5)
+        self.assertEqual(self.client().get(
+            '/venues/nearby?lat=91&lon=0').status_code, 400)
+
+    def test_venues_geocoded_from_city_centroids(self):
+        res = self.client().post('/venues/create', data={
+            "name": "test-venue-geocoded", "city": "santa  fe", "state": "NM",
+            "address": "1 Test St", "phone": "123-123-1234",
+            "genres": ["Jazz"], "facebook_link": "https://fb.com/test"})
+        self.assertIn(b"successfully listed", res.data)
+        venue = Venue.query.filter_by(name="test-venue-geocoded").one()
+        self.assertEqual((venue.latitude, venue.longitude), (35.687, -105.9378))
+
+        imported = self.add_venue("Tucson", state="AZ")
+        db.session.commit()
+        self.assertIsNone(imported.latitude)
+        geocode_venues()
+        db.session.commit()
+        self.assertEqual(Venue.query.get(imported.id).latitude, 32.2226)
+
+    def test_venues_in_unknown_cities_are_reported(self):
+        res = self.client().post('/venues/create', data={
+            "name": "test-venue-unknown-city", "city": "Nowhere", "state": "NM",
+            "address": "1 Test St", "phone": "123-123-1234",
+            "genres": ["Jazz"], "facebook_link": "https://fb.com/test"})
+        self.assertIn(b"Nowhere, NM is not in the list of known cities", res.data)
+        venue_id = Venue.query.filter_by(name="test-venue-unknown-city").one().id
+
+        edit = '/venues/{}/edit'.format(venue_id)
+        with self.client() as client:
+            client.post(edit, data={"name": "test-venue-unknown-city",
+                                    "city": "Santa Fe", "state": "NM",
+                                    "version": 1})
+            self.assertNotIn(b"known cities", client.get(edit).data)
+            client.post(edit, data={"name": "test-venue-unknown-city",
+                                    "city": "Elsewhere", "state": "nm",
+                                    "version": 2})
+            self.assertIn(b"Elsewhere, NM is not in the list of known cities",
+                          client.get(edit).data)
+
+    def test_edit_venue_city_alone_is_geocoded(self):
+        venue = self.add_venue("Austin", state="TX")
+        db.session.commit()
+        venue_id = venue.id
+        edit = '/venues/{}/edit'.format(venue_id)
+
+        with self.client() as client:
+            res = client.post(edit, data={"name": "test-venue-city-only",
+                                          "city": "Houston", "version": 1})
+            self.assertEqual(res.status_code, 302)
+            db.session.expire_all()
+            self.assertEqual(Venue.query.get(venue_id).latitude, 29.7604)
+
+            res = client.post(edit, data={"name": "test-venue-city-only",
+                                          "city": "Nowhere", "version": 2})
+            self.assertEqual(res.status_code, 302)
+            self.assertIn(b"Nowhere, TX is not in the list of known cities",
+                          client.get(edit).data)
+
+            client.post(edit, data={"name": "test-venue-city-only",
+                                    "version": 3})
+            self.assertNotIn(b"known cities", client.get(edit).data)
+
+    def test_edit_venue_issues_one_targeted_update(self):
+        venue = self.add_venue("test-city-edit")
+        db.session.commit()
+        venue_id = venue.id
+
+        self.statements = []
+        res = self.client().post('/venues/{}/edit'.format(venue_id), data={
+            "name": "test-venue-edited", "city": "Austin", "state": "tx",
+            "seeking_talent": "No", "version": 1})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(len(self.statements), 1)
+        self.assertTrue(self.statements[0].startswith('UPDATE "Venue"'))
+        db.session.expire_all()
+        venue = Venue.query.get(venue_id)
+        self.assertEqual((venue.name, venue.state, venue.version),
+                         ("test-venue-edited", "TX", 2))
+        self.assertFalse(venue.seeking_talent)
+        self.assertEqual(venue.address, "1 Test St")
+        self.assertEqual(venue.latitude, 30.2672)
+
+    def test_edit_artist_with_stale_version_is_refused(self):
+        artist = self.add_artist("artist-stale")
+        db.session.commit()
+        artist_id = artist.id
+        edit = '/artists/{}/edit'.format(artist_id)
+
+        self.client().post(edit, data={"name": "test-artist-first", "version": 1})
+        with self.client() as client:
+            res = client.post(edit, data={"name": "test-artist-second",
+                                          "version": 1})
+            self.assertTrue(res.location.endswith(edit))
+            self.assertIn(b"changed by someone else", client.get(edit).data)
+
+        db.session.expire_all()
+        artist = Artist.query.get(artist_id)
+        self.assertEqual((artist.name, artist.version), ("test-artist-first", 2))
+
+    def test_recommended_artists_ranked_for_venue(self):
+        recommender.clear()
+        venue = self.add_venue("test-city-recommend", state="ID")
+        venue.genres = ["Jazz", "Blues"]
+        local = self.add_artist("artist-recommend-local")
+        in_state = self.add_artist("artist-recommend-state")
+        regular = self.add_artist("artist-recommend-regular")
+        not_seeking = self.add_artist("artist-recommend-busy")
+        for artist in (local, in_state, regular, not_seeking):
+            artist.state = "ID"
+            artist.seeking_venue = artist is not not_seeking
+        local.city = regular.city = not_seeking.city = "test-city-recommend"
+        local.genres = not_seeking.genres = ["Jazz", "Blues"]
+        regular.genres = ["Rock n Roll"]
+        db.session.flush()
+        for day in range(1, 4):
+            self.add_show(venue, regular, datetime(2001, 1, day, 20))
+        db.session.commit()
+        url = '/venues/{}/recommended-artists'.format(venue.id)
+        local_id, in_state_id = local.id, in_state.id
+
+        artists = self.client().get(url).get_json()["artists"]
+
+        self.assertEqual([artist["id"] for artist in artists[:3]],
+                         [local_id, in_state_id, regular.id])
+        self.assertEqual(artists[0]["score"], 0.85)
+        self.assertEqual(artists[2]["bookings"], 3)
+        self.assertNotIn(not_seeking.id, [artist["id"] for artist in artists])
+
+        # The session is closed by the delete handler.
+        self.client().delete('/artists/{}'.format(local_id))
+
+        artists = self.client().get(url + '?fields=id').get_json()["artists"]
+        self.assertEqual(artists[0], {"id": in_state_id})
+
+    def test_recommendations_answered_while_another_venue_loads(self):
+        Row = namedtuple("Row", "id name genres city state")
+        slow_venue_started = threading.Event()
+        release = threading.Event()
+
+        def load_venue(venue_id):
+            if venue_id == 2:
+                slow_venue_started.set()
+                release.wait(5)
+            return Row(venue_id, "venue", ["Jazz"], "city", "ST")
+
+        recommend = Recommender(
+            app, lambda ids=None: [Row(1, "artist", ["Jazz"], "city", "ST")],
+            load_venue, lambda venue_id: {})
+        self.assertEqual([r.id for r in recommend.recommend(1)], [1])
+
+        slow = threading.Thread(target=recommend.recommend, args=(2,))
+        slow.start()
+        self.assertTrue(slow_venue_started.wait(5))
+        # Venue 2 is still loading and does not hold up venue 1.
+        self.assertEqual([r.id for r in recommend.recommend(1)], [1])
+        self.assertTrue(slow.is_alive())
+        release.set()
+        slow.join(5)
+        self.assertIn(2, recommend.rankings)
+
+    def test_import_skips_malformed_values(self):
+        venue = self.add_venue("test-city-import")
+        artist = self.add_artist("artist-import")
+        db.session.commit()
+        venue_id, artist_id = venue.id, artist.id
+        rows = [
+            "venue_id,artist_id,start_time,duration",
+            "{v},{a},2031-05-21T21:30:00.000Z,90",
+            "{v},{a},not a date,90",
+            "{v},{a},2031-05-22T21:30:00,ninety",
+            "{v},x{a},2031-05-23T21:30:00,",
+            "{v},{a},2031-05-24 21:30,",
+        ]
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(handle, "w") as stream:
+            stream.write("\n".join(rows).format(v=venue_id, a=artist_id))
+
+        try:
+            result = app.test_cli_runner().invoke(import_data, ["shows", path])
+        finally:
+            os.remove(path)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("2 rows imported, 3 skipped", result.output)
+        shows = Shows.query.filter_by(artist_id=artist_id) \
+            .order_by(Shows.start_time).all()
+        self.assertEqual([(show.start_time, show.duration) for show in shows],
+                         [(datetime(2031, 5, 21, 21, 30), 90),
+                          (datetime(2031, 5, 24, 21, 30), 120)])
+
+    def test_advisor_explains_only_reads(self):
+        self.assertTrue(explainable('SELECT * FROM "Venue"'))
+        self.assertTrue(explainable(
+            'WITH v AS (SELECT id FROM "Venue") SELECT * FROM v'))
+        self.assertFalse(explainable(
+            'WITH d AS (DELETE FROM "Shows" RETURNING show_id) SELECT * FROM d'))
+        self.assertFalse(explainable('UPDATE "Venue" SET name = name'))
+
+    def test_advisor_covers_streamed_and_parameterised_routes(self):
+        app.config["STREAM_LISTINGS"] = True
+        self.addCleanup(app.config.__setitem__, "STREAM_LISTINGS", False)
+        self.seed_cities(1)
+
+        result = app.test_cli_runner().invoke(advise_indexes,
+                                              ["--min-rows", "1000000000"])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertRegex(result.output, r"GET /venues \([1-9]\d* statements\)")
+        self.assertRegex(result.output, r"GET /genres/\S+/shows \([1-9]")
+        self.assertRegex(result.output, r"GET /venues/nearby\?lat=\S+ \([1-9]")
+
+    def test_404_venue_page(self):
+        res = self.client().get('/venues/0')
+
+        self.assertEqual(res.status_code, 404)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
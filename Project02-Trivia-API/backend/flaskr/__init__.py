@@ -1,13 +1,63 @@
 import os
+import threading
+import time
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category
+from flaskr.categories import CategoryRegistry
+from flaskr.quiz import QuizPool
+from flaskr.search import search, count_capped
 
 QUESTIONS_PER_PAGE = 10
 
+# Search results are counted up to this many; a common word can match a
+# large share of the questions, and counting them all would cost more
+# than the page itself.
+SEARCH_COUNT_LIMIT = 1000
+
+# Seconds the total number of questions may lag behind questions added
+# or deleted through other workers.
+QUESTION_COUNT_TTL = 60
+
+# Seconds between reloads of the question ids the quiz draws from.
+QUIZ_POOL_TTL = 300
+
+# Seconds between checks of the categories table for changes.
+CATEGORY_CHECK_INTERVAL = 30
+
+# Changes whenever a category is added, removed or renamed.
+CATEGORY_CHANGE_TOKEN = """
+    SELECT md5(coalesce(string_agg(id || ':' || type, ',' ORDER BY id), ''))
+    FROM categories
+"""
+
+
+class CachedCount:
+    '''
+    Result of a count query, run again at most every `ttl` seconds
+    or after invalidate() is called by a write.
+    '''
+
+    def __init__(self, count, ttl):
+        self.count = count
+        self.ttl = ttl
+        self.value = None
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.value is None or time.monotonic() >= self.expires:
+                self.value = self.count()
+                self.expires = time.monotonic() + self.ttl
+            return self.value
+
+    def invalidate(self):
+        with self.lock:
+            self.value = None
+
 
 def create_app(test_config=None):
     # create and configure the app
@@ -17,6 +67,47 @@ def create_app(test_config=None):
     # Set up CORS. Allow '*' for origins.
     CORS(app, resources={r"/*": {"origins": "*"}})
 
+    question_count = CachedCount(
+        lambda: db.session.query(db.func.count(Question.id)).scalar(),
+        QUESTION_COUNT_TTL)
+
+    # Counts of the questions of each category listed so far, shared by
+    # the request threads.
+    category_counts = dict()
+    category_counts_lock = threading.Lock()
+
+    def category_count(category_id):
+        with category_counts_lock:
+            count = category_counts.get(category_id)
+            if count is None:
+                count = category_counts[category_id] = CachedCount(
+                    lambda: Question.query.filter(
+                        Question.category == category_id).count(),
+                    QUESTION_COUNT_TTL)
+        return count.get()
+
+    def invalidate_counts(category_id):
+        question_count.invalidate()
+        with category_counts_lock:
+            count = category_counts.get(category_id)
+        if count is not None:
+            count.invalidate()
+
+    def load_quiz_ids():
+        # Runs in a thread of the quiz pool, outside any request.
+        with app.app_context():
+            return db.session.query(
+                Question.category, db.func.array_agg(Question.id)
+            ).group_by(Question.category).all()
+
+    quiz_pool = QuizPool(load_quiz_ids, QUIZ_POOL_TTL)
+
+    categories = CategoryRegistry(
+        lambda: db.session.query(Category.id, Category.type)
+        .order_by(Category.id),
+        lambda: db.session.execute(CATEGORY_CHANGE_TOKEN).scalar(),
+        CATEGORY_CHECK_INTERVAL)
+
     @app.after_request
     def after_request(response):
         '''
@@ -33,16 +124,16 @@ def create_app(test_config=None):
         '''
         The endpoint to handle GET requests 
         for all available categories.
-        '''
-        categories = dict()
 
-        for category in Category.query.all():
-            categories[category.id] = category.type
+        The body is serialized once per version of the categories table,
+        whose change token doubles as the ETag.
+        '''
+        snapshot = categories.current()
 
-        return jsonify({
-            "categories": categories,
-            "success": True
-        })
+        response = app.response_class(snapshot.body,
+                                      mimetype="application/json")
+        response.set_etag(snapshot.token)
+        return response.make_conditional(request)
 
     @app.route("/questions", methods=["GET"])
     def get_questions():
@@ -52,34 +143,36 @@ def create_app(test_config=None):
         This endpoint should return a list of questions, 
         number of total questions, current category, categories. 
 
+        Pages are read with LIMIT/OFFSET, or, given `after_id`, as the
+        questions following that id, which costs the same on any page.
+
         TEST: At this point, when you start the application
         you should see questions and categories generated,
         ten questions per page and pagination at the bottom of the screen for three pages.
         Clicking on the page numbers should update the questions. 
         '''
 
-        questions = list()
-
-        categories = dict()
-
-        for category in Category.query.all():
-            categories[category.id] = category.type
+        page = max(request.args.get("page", 1, type=int), 1)
+        after_id = request.args.get("after_id", type=int)
 
-        page = int(request.args.get("page", 1))
+        query = Question.query.order_by(Question.id)
 
-        start = (page-1)*10
-        end = start + QUESTIONS_PER_PAGE
+        if after_id is not None:
+            query = query.filter(Question.id > after_id)
+        else:
+            query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
 
-        questions = [question.format() for question in Question.query.all()]
+        questions = [question.format()
+                     for question in query.limit(QUESTIONS_PER_PAGE)]
 
-        if start > len(questions):
+        if not questions and page > 1:
             abort(404)
 
         return jsonify({
-            "questions": questions[start:end],
+            "questions": questions,
             "success": True,
-            "total_questions": len(questions),
-            "categories": categories
+            "total_questions": question_count.get(),
+            "categories": categories.types()
         })
 
     @app.route("/questions/<question_id>", methods=['DELETE'])
@@ -96,6 +189,7 @@ def create_app(test_config=None):
             if not question:
                 abort(422)
             question.delete()
+            invalidate_counts(question.category)
         except:
             abort(422)
 
@@ -120,9 +214,11 @@ def create_app(test_config=None):
 
         try:
             question = Question(data["question"], data["answer"],
-                                data["category"], int(data["difficulty"]))
+                                int(data["category"]), int(data["difficulty"]))
 
             question.insert()
+            invalidate_counts(question.category)
+            quiz_pool.add(question.category, question.id)
         except:
             abort(422)
 
@@ -138,33 +234,50 @@ def create_app(test_config=None):
         TEST: Search by any phrase. The questions list will update to include 
         only question that include that string within their question. 
         Try using the word "title" to start. 
+
+        Questions and answers are searched through the full-text index
+        of migrations/001_question_search.sql, best matches first, a page
+        at a time. `prefix` matches the words as the start of words, for
+        type-ahead; `category` and `difficulty` narrow the results.
         '''
 
-        if not request.json.get("searchTerm"):
+        data = request.get_json()
+
+        if not data.get("searchTerm"):
             abort(404)
 
-        categories = dict()
+        try:
+            page = max(int(data.get("page", 1)), 1)
+            category = data.get("category")
+            category = int(category) if category is not None else None
+            difficulty = data.get("difficulty")
+            difficulty = int(difficulty) if difficulty is not None else None
+        except (TypeError, ValueError):
+            abort(422)
 
-        for category in Category.query.all():
-            categories[category.id] = category.type
+        query = search(data["searchTerm"], bool(data.get("prefix")),
+                       category, difficulty)
 
-        search_term = "%" + request.json.get("searchTerm", "") + "%"
+        if query is None:
+            abort(404)
 
-        questions = Question.query.filter(Question.question.ilike(search_term))
+        questions = [question.format() for question in query.offset(
+            (page - 1) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE)]
 
         if not questions:
             abort(404)
 
-        questions = [question.format() for question in questions]
+        total = count_capped(query, SEARCH_COUNT_LIMIT)
 
         return jsonify({
             "questions": questions,
             "success": True,
-            "total_questions": len(questions),
-            "categories": categories
+            "total_questions": min(total, SEARCH_COUNT_LIMIT),
+            "total_questions_capped": total > SEARCH_COUNT_LIMIT,
+            "categories": categories.types()
         })
 
-    @app.route("/categories/<category_id>/questions", methods=["GET"])
+    @app.route("/categories/<int:category_id>/questions", methods=["GET"])
     def get_questions_with_category(category_id):
         '''
         A GET endpoint to get questions based on category. 
@@ -172,24 +285,39 @@ def create_app(test_config=None):
         TEST: In the "List" tab / main screen, clicking on one of the 
         categories in the left column will cause only questions of that 
         category to be shown. 
+
+        Paginated like GET /questions, by `page` or `after_id`, and read
+        in id order from the (category, id) index. The total is recounted
+        as for GET /questions.
         '''
 
-        questions = [question.format() for question in Question.query.filter_by(
-            category=str(category_id))]
+        current_category = categories.types().get(category_id)
 
-        try:
-            current_category = Category.query.get(category_id)
-        except:
+        if current_category is None:
             abort(404)
 
-        if not current_category or not questions:
+        page = max(request.args.get("page", 1, type=int), 1)
+        after_id = request.args.get("after_id", type=int)
+
+        query = Question.query.filter(
+            Question.category == category_id).order_by(Question.id)
+
+        if after_id is not None:
+            query = query.filter(Question.id > after_id)
+        else:
+            query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+        questions = [question.format()
+                     for question in query.limit(QUESTIONS_PER_PAGE)]
+
+        if not questions:
             abort(404)
 
         return jsonify({
             "questions": questions,
             "success": True,
-            "total_questions": len(questions),
-            "current_category": current_category.type
+            "total_questions": category_count(category_id),
+            "current_category": current_category
         })
 
     @app.route("/quizzes", methods=["POST"])
@@ -203,26 +331,29 @@ def create_app(test_config=None):
         TEST: In the "Play" tab, after a user selects "All" or a category,
         one question at a time is displayed, the user is allowed to answer
         and shown whether they were correct or not. 
+
+        Category id 0 stands for "All". The question is drawn from the
+        ids in quiz_pool and fetched by primary key, so the cost does not
+        depend on the size of the category or of previous_questions.
         '''
         try:
             quiz = request.get_json()["quiz_category"]
+            category_id = int(quiz["id"]) or None
+            seen = set(request.get_json().get("previous_questions") or [])
         except:
             abort(422)
 
-        if "id" not in quiz:
-            abort(422)
-
-        category_id = quiz["id"]
-
-        previous_questions = request.get_json()["previous_questions"]
-
-        questions = Question.query.filter_by(category=category_id).filter(
-            Question.id.notin_((previous_questions))).all()
-
-        questions = [question.format() for question in questions]
+        question = None
+        while question is None:
+            question_id = quiz_pool.pick(category_id, seen)
+            if question_id is None:
+                break
+            question = Question.query.get(question_id)
+            # Deleted since the pool was loaded.
+            seen.add(question_id)
 
         return jsonify({
-            "question": random.choice(questions) if questions else None,
+            "question": question.format() if question else None,
             "success": True
         })
 
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+from array import array
+
+# Random draws tried before falling back to listing the unseen questions.
+PICK_ATTEMPTS = 8
+
+
+class QuizPool:
+    '''
+    Ids of the questions of each category, kept in memory by every worker
+    so a random unseen question is drawn without querying the category.
+
+    `load` returns (category, ids) pairs, the ids of the questions of
+    each category, questions without a category under None. It is called
+    from a thread of its own, so it must set up its own database session.
+
+    The ids are loaded again every `ttl` seconds, picking up questions
+    added through other workers; questions deleted since are skipped when
+    they are fetched. Only the first load is waited for: later ones run
+    in a background thread, one at a time, while requests keep drawing
+    from the ids loaded before.
+    '''
+
+    def __init__(self, load, ttl):
+        self.load = load
+        self.ttl = ttl
+        # (ids by category, all ids), replaced as a whole by each load.
+        self.pool = None
+        self.expires = 0
+        self.lock = threading.Lock()
+        self.refreshing = threading.Lock()
+
+    def refresh(self):
+        '''
+        Load the ids and swap them in.
+        '''
+        by_category = {}
+        everything = array('l')
+        for category, ids in self.load():
+            ids = array('l', ids)
+            if category is not None:
+                by_category[int(category)] = ids
+            everything.extend(ids)
+        with self.lock:
+            self.pool = by_category, everything
+            self.expires = time.monotonic() + self.ttl
+
+    def refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Keep the ids loaded before and try again after `ttl`.
+            self.expires = time.monotonic() + self.ttl
+            raise
+        finally:
+            self.refreshing.release()
+
+    def ids(self, category=None):
+        '''
+        Ids of the questions of `category`, or of all questions if None.
+        '''
+        if self.pool is None:
+            with self.refreshing:
+                if self.pool is None:
+                    loader = threading.Thread(target=self.refresh)
+                    loader.start()
+                    loader.join()
+                    if self.pool is None:
+                        raise RuntimeError("loading the quiz questions failed")
+        elif time.monotonic() >= self.expires and \
+                self.refreshing.acquire(blocking=False):
+            threading.Thread(target=self.refresh_in_background,
+                             daemon=True).start()
+
+        by_category, everything = self.pool
+        if category is None:
+            return everything
+        return by_category.get(category, array('l'))
+
+    def add(self, category, question_id):
+        with self.lock:
+            if self.pool is None:
+                return
+            by_category, everything = self.pool
+            if category is not None:
+                by_category.setdefault(int(category), array('l')).append(question_id)
+            everything.append(question_id)
+
+    def pick(self, category, seen):
+        '''
+        Return a random id of `category` (None for all) not in `seen`,
+        or None once every question was seen. A few random draws almost
+        always succeed; only a nearly exhausted category is scanned.
+        '''
+        ids = self.ids(category)
+        if not ids:
+            return None
+
+        for _ in range(PICK_ATTEMPTS):
+            question_id = ids[random.randrange(len(ids))]
+            if question_id not in seen:
+                return question_id
+
+        unseen = [question_id for question_id in ids if question_id not in seen]
+        return random.choice(unseen) if unseen else None
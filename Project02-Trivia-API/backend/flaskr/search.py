@@ -0,0 +1,59 @@
+import re
+
+from sqlalchemy import func, literal_column
+
+from models import Question
+
+# Text search configuration of the questions' search_vector column,
+# added by migrations/001_question_search.sql.
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+
+VECTOR = literal_column("questions.search_vector")
+
+WORD = re.compile(r"\w+")
+
+
+def parse(term, prefix=False):
+    '''
+    Return the tsquery for a search term. Words are matched whole, with
+    web search syntax ("quoted phrases", or, -excluded), or, with
+    `prefix`, every word as the start of a word for type-ahead.
+    Return None if the term holds no word to search for.
+    '''
+    if prefix:
+        words = WORD.findall(term)
+        if not words:
+            return None
+        return func.to_tsquery(
+            SEARCH_CONFIG, " & ".join(word + ":*" for word in words))
+
+    if not WORD.search(term):
+        return None
+    return func.websearch_to_tsquery(SEARCH_CONFIG, term)
+
+
+def count_capped(query, limit):
+    '''
+    Count the rows of `query`, stopping at `limit` + 1, so a term matching
+    millions of questions is counted as fast as one matching a thousand.
+    '''
+    return query.order_by(None).limit(limit + 1).count()
+
+
+def search(term, prefix=False, category=None, difficulty=None):
+    '''
+    Return the query of the questions matching `term`, best first, or
+    None if the term holds no word to search for.
+    '''
+    tsquery = parse(term, prefix)
+    if tsquery is None:
+        return None
+
+    query = Question.query.filter(VECTOR.op("@@")(tsquery))
+
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+
+    return query.order_by(func.ts_rank(VECTOR, tsquery).desc(), Question.id)
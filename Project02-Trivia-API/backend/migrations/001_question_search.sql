@@ -0,0 +1,17 @@
+-- Full-text search over questions and their answers, used by POST /search.
+-- The question text weighs more (A) than the answer (B) in the ranking.
+-- The vector is stored so that ranking the matches does not parse their
+-- text again.
+--
+-- Run outside a transaction (plain psql does), since the index is built
+-- concurrently to keep the table writable meanwhile:
+--     psql trivia < migrations/001_question_search.sql
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english'::regconfig, coalesce(question, '')), 'A') ||
+        setweight(to_tsvector('english'::regconfig, coalesce(answer, '')), 'B')
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_search
+    ON questions USING gin (search_vector);
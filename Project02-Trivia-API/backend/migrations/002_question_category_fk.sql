@@ -0,0 +1,46 @@
+-- questions.category holds the id of a category. Databases restored from
+-- trivia.psql already store it as an integer with a foreign key; those
+-- created by db.create_all() store it as text without one. Bring both to
+-- an integer foreign key, and index (category, id) for listing and
+-- counting the questions of a category.
+--
+--     psql trivia < migrations/002_question_category_fk.sql
+
+BEGIN;
+
+-- Text ids become integers; anything that is not an id becomes NULL.
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'questions'
+        AND column_name = 'category') <> 'integer' THEN
+        ALTER TABLE questions ALTER COLUMN category TYPE integer
+            USING CASE WHEN btrim(category) ~ '^[0-9]{1,9}$'
+                       THEN btrim(category)::integer END;
+    END IF;
+END
+$$;
+
+-- Ids of categories that no longer exist cannot be kept under the
+-- foreign key; clear them, as deleting the category would have.
+UPDATE questions SET category = NULL
+WHERE category IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM categories WHERE categories.id = questions.category);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'questions'::regclass AND contype = 'f'
+          AND confrelid = 'categories'::regclass) THEN
+        ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category)
+            REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+COMMIT;
+
+-- Built concurrently, outside the transaction, to keep the table writable.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_category_id
+    ON questions (category, id);
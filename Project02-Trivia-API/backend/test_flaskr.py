@@ -1,10 +1,14 @@
 import os
 import unittest
 import json
+import threading
+import time
+from unittest import mock
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.quiz import QuizPool
+from models import setup_db, db, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -47,6 +51,32 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Resource not found')
 
+    def test_get_questions_after_id(self):
+        res = self.client().get('/questions')
+        first_page = json.loads(res.data)['questions']
+
+        res = self.client().get(
+            '/questions?after_id={}'.format(first_page[4]['id']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in data['questions'][:5]],
+                         [question['id'] for question in first_page[5:]])
+
+    def test_total_questions_follows_added_questions(self):
+        total_before = json.loads(
+            self.client().get('/questions').data)['total_questions']
+
+        res = self.client().post('/questions', json={
+            'question': 'counted question', 'answer': 'counted answer',
+            'difficulty': 1, 'category': 1})
+        question_id = json.loads(res.data)['id']
+        total_after = json.loads(
+            self.client().get('/questions').data)['total_questions']
+        self.client().delete(f'/questions/{question_id}')
+
+        self.assertEqual(total_after, total_before + 1)
+
     def test_get_categories(self):
         res = self.client().get('/categories')
         data = json.loads(res.data)
@@ -55,6 +85,33 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['categories']))
 
+    def test_304_get_unchanged_categories(self):
+        etag = self.client().get('/categories').headers['ETag']
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_categories_follows_changes(self):
+        with mock.patch('flaskr.CATEGORY_CHECK_INTERVAL', 0):
+            app = create_app()
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        before = json.loads(client.get('/categories').data)['categories']
+
+        with app.app_context():
+            category = Category(type='Music')
+            db.session.add(category)
+            db.session.commit()
+            category_id = category.id
+        after = json.loads(client.get('/categories').data)['categories']
+        with app.app_context():
+            Category.query.filter_by(id=category_id).delete()
+            db.session.commit()
+
+        self.assertNotIn(str(category_id), before)
+        self.assertEqual(after[str(category_id)], 'Music')
+
     def test_delete_question(self):
         question = Question(question='new question', answer='new answer',
                             difficulty=1, category=1)
@@ -110,7 +167,7 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "Unprocessable")
 
     def test_search_questions(self):
-        new_search = {'searchTerm': 'a'}
+        new_search = {'searchTerm': 'title'}
         res = self.client().post('/search', json=new_search)
         data = json.loads(res.data)
 
@@ -119,6 +176,55 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNotNone(data['questions'])
         self.assertIsNotNone(data['total_questions'])
 
+    def test_search_ranks_questions_before_answers(self):
+        res = self.client().post('/search', json={'searchTerm': 'tom'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in data['questions']],
+                         [2, 4])
+        self.assertEqual(data['total_questions'], 2)
+
+    def test_search_total_is_capped(self):
+        with mock.patch('flaskr.SEARCH_COUNT_LIMIT', 1):
+            res = self.client().post('/search', json={'searchTerm': 'tom'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 2)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertTrue(data['total_questions_capped'])
+
+    def test_search_prefix(self):
+        res = self.client().post('/search', json={'searchTerm': 'socc',
+                                                  'prefix': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(question['id'] for question in data['questions']),
+                         [10, 11])
+
+        res = self.client().post('/search', json={'searchTerm': 'socc'})
+        self.assertEqual(res.status_code, 404)
+
+    def test_search_with_filters(self):
+        res = self.client().post('/search', json={'searchTerm': 'soccer',
+                                                  'category': 6,
+                                                  'difficulty': 4})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in data['questions']],
+                         [11])
+
+    def test_422_search_question(self):
+        res = self.client().post('/search', json={'searchTerm': 'soccer',
+                                                  'difficulty': 'hard'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
     def test_404_search_question(self):
         new_search = {
             'searchTerm': '',
@@ -148,6 +254,59 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Resource not found")
 
+    def test_404_get_questions_of_unknown_category(self):
+        res = self.client().get('/categories/1000/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
+    def test_get_questions_per_category_after_id(self):
+        res = self.client().get('/categories/1/questions')
+        first_page = json.loads(res.data)
+
+        res = self.client().get('/categories/1/questions?after_id={}'.format(
+            first_page['questions'][0]['id']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'][0]['id'],
+                         first_page['questions'][1]['id'])
+        self.assertEqual(data['total_questions'], first_page['total_questions'])
+
+    def test_category_count_shared_by_concurrent_requests(self):
+        from flaskr import CachedCount
+        created = []
+
+        class SlowCachedCount(CachedCount):
+            def __init__(self, *args):
+                created.append(self)
+                time.sleep(0.1)
+                super().__init__(*args)
+
+        def get_category():
+            self.assertEqual(client.get(
+                '/categories/2/questions').status_code, 200)
+
+        client = self.client()
+        with mock.patch('flaskr.CachedCount', SlowCachedCount):
+            threads = [threading.Thread(target=get_category) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(created), 1)
+
+    def test_422_add_question_to_unknown_category(self):
+        res = self.client().post('/questions', json={
+            'question': 'new question', 'answer': 'new answer',
+            'difficulty': 1, 'category': 1000})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
     def test_play_quiz(self):
         new_quiz_round = {'previous_questions': [],
                           'quiz_category': {'type': 'Entertainment', 'id': 5}}
@@ -158,6 +317,59 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    def test_play_quiz_until_out_of_questions(self):
+        with self.app.app_context():
+            category_size = Question.query.filter(
+                Question.category == 1).count()
+
+        previous_questions = []
+        while True:
+            res = self.client().post('/quizzes', json={
+                'previous_questions': previous_questions,
+                'quiz_category': {'type': 'Science', 'id': '1'}})
+            question = json.loads(res.data)['question']
+            if question is None:
+                break
+            self.assertEqual(question['category'], 1)
+            self.assertNotIn(question['id'], previous_questions)
+            previous_questions.append(question['id'])
+
+        self.assertEqual(len(previous_questions), category_size)
+
+    def test_play_quiz_all_categories(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(data['question'])
+
+    def test_quiz_pool_serves_loaded_ids_while_reloading(self):
+        reload_started = threading.Event()
+        release = threading.Event()
+        loads = []
+
+        def load():
+            loads.append(None)
+            if len(loads) > 1:
+                reload_started.set()
+                release.wait(5)
+            return [(1, [len(loads)])]
+
+        pool = QuizPool(load, 0)
+        self.assertEqual(list(pool.ids(1)), [1])
+        # The reload blocks until released, and is not waited for.
+        self.assertEqual(list(pool.ids(1)), [1])
+        self.assertTrue(reload_started.wait(5))
+        self.assertEqual(list(pool.ids(1)), [1])
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while list(pool.ids(1)) == [1] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertNotEqual(list(pool.ids(1)), [1])
+
     def test_404_play_quiz(self):
         new_quiz_round = {'previous_questions': []}
         res = self.client().post('/quizzes', json=new_quiz_round)